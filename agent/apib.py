@@ -1,107 +1,251 @@
-import requests
-import csv
+import asyncio
+import atexit
+import json
+import logging
+import multiprocessing
 import os
-import time
+import re
+import sys
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
 from dotenv import load_dotenv
 import urllib3
-
-print("Starting script...")
+from cache import TTLCache
+from compose import Document
+from dedup import SeenIds
+from gql_client import GraphQLClient, operation_name, response_data
+from horizon_journal import HorizonJournal
+from json_stream import iter_array_items
+from limiter import AdaptiveLimiter
+import logs
+from metrics import Registry, serve as serve_metrics
+from price_sampler import PriceSampler
+from row_store import RowStore
+from rows import make_row_class
+from schema import COLUMN_KINDS, COLUMN_NAMES, SCHEMA, build_rows
+from singleflight import SingleFlight
+from sqlite_store import SqliteRowStore
+from scheduler import TimerScheduler
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 load_dotenv()
+# Records are written by a background thread, as text or LOG_FORMAT=json lines. Per-broadcast
+# and per-request lines are DEBUG; at INFO a summary every LOG_SUMMARY_INTERVAL seconds stands in for them.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", "10"))
+log_listener = logs.configure(LOG_LEVEL, LOG_FORMAT)
+log = logging.getLogger("apib")
+log.info("Starting script...")
+
 bearer_token = os.getenv('BEARER_TOKEN')
 
 if not bearer_token:
-    print("Error: No BEARER_TOKEN found in environment.")
+    log.error("No BEARER_TOKEN found in environment.")
     exit(1)
 
-print(f"Using bearer token: {bearer_token[:5]}...{bearer_token[-5:]}")  # Print first/last 5 chars for verification
+log.info("Using bearer token: %s...%s", bearer_token[:5], bearer_token[-5:])  # first/last 5 chars for verification
 
-GRAPHQL_ENDPOINT = "https://mainnet-api.vector.fun/graphql"
+GRAPHQL_ENDPOINT = os.getenv("GRAPHQL_ENDPOINT", "https://mainnet-api.vector.fun/graphql")
 HEADERS = {
     "Content-Type": "application/json",
     #"Authorization": f"Bearer {bearer_token}"
 }
 
 # Verify headers are set
-print(f"Headers configured: {HEADERS}")
+log.info("Headers configured: %s", HEADERS)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# Requests in flight adapt between HTTP_CONCURRENCY_MIN and HTTP_CONCURRENCY_MAX: one more per
+# window of healthy responses, halved on a 429, 5xx, timeout or a response slower than
+# HTTP_LATENCY_TARGET seconds. Those failures are retried HTTP_MAX_RETRIES times with jittered
+# exponential backoff from HTTP_RETRY_BASE seconds, and never before the server's Retry-After.
+HTTP_CONCURRENCY_INITIAL = int(os.getenv("HTTP_CONCURRENCY_INITIAL", "8"))
+HTTP_CONCURRENCY_MIN = int(os.getenv("HTTP_CONCURRENCY_MIN", "1"))
+HTTP_CONCURRENCY_MAX = int(os.getenv("HTTP_CONCURRENCY_MAX", str(HTTP_POOL_SIZE)))
+HTTP_LATENCY_TARGET = float(os.getenv("HTTP_LATENCY_TARGET", "2"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_RETRY_BASE = float(os.getenv("HTTP_RETRY_BASE", "0.5"))
+# Concurrent identical requests, and concurrent lookups of one profile or token from
+# different enrichment batches, share a single request; SINGLE_FLIGHT=0 turns that off.
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+# Send a sha256 hash instead of the query text (automatic persisted queries); the
+# full text is only resent when the server answers PersistedQueryNotFound.
+PERSISTED_QUERIES = os.getenv("PERSISTED_QUERIES", "0") == "1"
+# Prometheus text metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; 0 disables the endpoint.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+registry = Registry(prefix="apib_")
+graphql_latency = registry.histogram("graphql_request_seconds", "GraphQL request latency by operation.", ["operation"])
+graphql_errors = registry.counter("graphql_errors_total", "GraphQL requests that gave no usable data.", ["operation"])
+graphql_coalesced = registry.counter("graphql_coalesced_total",
+                                     "GraphQL calls answered by an identical request already in flight.", ["operation"])
+lookups_coalesced = registry.counter("lookups_coalesced_total",
+                                     "Enrichment lookups answered by another batch's request in flight.", ["kind"])
+graphql_retries = registry.counter("graphql_retries_total", "GraphQL requests retried, by failure.",
+                                   ["operation", "reason"])
+stage_latency = registry.histogram("stage_seconds", "Time spent per scraper stage.", ["stage"])
+broadcasts_seen = registry.counter("broadcasts_total", "Broadcasts taken from the feed by outcome.", ["result"])
+variance_lateness = registry.histogram("variance_check_lateness_seconds",
+                                       "How long after its intended time each variance check ran.", ["horizon"],
+                                       buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+
+def make_client():
+    limiter = AdaptiveLimiter(initial=HTTP_CONCURRENCY_INITIAL, minimum=HTTP_CONCURRENCY_MIN,
+                              maximum=HTTP_CONCURRENCY_MAX, latency_target=HTTP_LATENCY_TARGET)
+    return GraphQLClient(GRAPHQL_ENDPOINT, HEADERS, pool_size=HTTP_POOL_SIZE, latency=graphql_latency,
+                         errors=graphql_errors, persisted_queries=PERSISTED_QUERIES, limiter=limiter,
+                         max_retries=HTTP_MAX_RETRIES, retry_base=HTTP_RETRY_BASE, retries=graphql_retries,
+                         single_flight=SINGLE_FLIGHT, coalesced=graphql_coalesced)
+
+
+client = make_client()
+registry.gauge("graphql_concurrency_limit", "Current adaptive cap on GraphQL requests in flight.",
+               callback=lambda: client.limiter.stats()["limit"])
+registry.gauge("graphql_in_flight", "GraphQL requests in flight.", callback=lambda: client.limiter.stats()["in_flight"])
 
 YOUR_PROFILE_ID = "f40e4966-d55a-4113-ba51-c995f61c2d55"
 
-columns = [
-    "broadcast_id", "created_at",
-    "user_id", "user_username",
-    "buy_token_id", "buy_token_amount", "buy_token_price_bcast", "buy_token_mcap_bcast",
-    "sell_token_id", "sell_token_amount", "sell_token_price_bcast", "sell_token_mcap_bcast",
-    "broadcast_has_buy_token", "broadcast_has_sell_token",
-    "user_twitter_username", "user_is_verified", "user_is_verified_binary",
-    "user_follower_count", "user_followee_count", "user_mutual_follower_count",
-    "user_mutual_followers_binary",
-    "user_visibility", "user_visible_public",
-    "user_weekly_rank", "user_weekly_value",
-    "user_weekly_rank_is_top100",
-    "user_best_rank", "user_best_rank_value",
-    "user_best_rank_is_top100",
-    "user_top_three_pnl_win_total",
-    "user_top_three_pnl_loss_total",
-    "user_top_three_volume_total",
-    "user_daily_pnl", "user_daily_volume",
-    "user_weekly_pnl", "user_weekly_volume",
-    "user_subscriber_count", "user_has_subscribers",
-    "user_followed_by_you", "user_followed_by_you_binary",
-    "user_subscribed_by_you", "user_subscribed_by_you_binary",
-    "user_has_twitter",
-    "buy_token_name", "buy_token_symbol", "buy_token_price", "buy_token_supply",
-    "buy_token_chain", "buy_token_liquidity", "buy_token_has_liquidity",
-    "buy_token_volume24h", "buy_token_volume6h", "buy_token_volume1h", "buy_token_volume5min",
-    "buy_token_buyVolume24h", "buy_token_sellVolume24h",
-    "buy_token_buyVolume6h", "buy_token_sellVolume6h",
-    "buy_token_buyVolume1h", "buy_token_sellVolume1h",
-    "buy_token_buyVolume5min", "buy_token_sellVolume5min",
-    "buy_token_buyCount24h", "buy_token_sellCount24h",
-    "buy_token_buyCount6h", "buy_token_sellCount6h",
-    "buy_token_buyCount1h", "buy_token_sellCount1h",
-    "buy_token_buyCount5min", "buy_token_sellCount5min",
-    "buy_token_verified", "buy_token_is_verified",
-    "buy_token_jupVerified", "buy_token_is_jupVerified",
-    "buy_token_freezable", "buy_token_is_freezable",
-    "buy_token_twitter", "buy_token_has_twitter",
-    "buy_token_telegram", "buy_token_has_telegram",
-    "buy_token_website", "buy_token_has_website",
-    "buy_token_discord", "buy_token_has_discord",
-    "buy_token_top10HolderPercent", "buy_token_top10HolderPercentV2",
-    "price_30s_variance", "price_1m_variance", "price_5m_variance",
-    "won_30s", "won_1m", "won_5m"
-]
+columns = COLUMN_NAMES
+BroadcastRow = make_row_class(columns, COLUMN_KINDS)
 
-output_file = "enriched_broadcasts.csv"
+output_file = os.getenv("OUTPUT_FILE", "enriched_broadcasts.csv")
+# "csv" appends to output_file; "sqlite" upserts into SQLITE_PATH and exports output_file on each compaction.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "enriched_broadcasts.db")
+COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "300"))
+# The CSV backend also compacts early once its patch log reaches this fraction of the CSV size.
+COMPACT_PATCH_RATIO = float(os.getenv("COMPACT_PATCH_RATIO", "0.25"))
+VARIANCE_WORKERS = int(os.getenv("VARIANCE_WORKERS", "4"))
+# A variance check whose price request failed is tried again after this many seconds.
+VARIANCE_RETRY_DELAY = float(os.getenv("VARIANCE_RETRY_DELAY", "5"))
+# Checks due within this many seconds of each other share one price request.
+PRICE_BATCH_WINDOW = float(os.getenv("PRICE_BATCH_WINDOW", "0.5"))
+PRICE_BATCH_MAX = int(os.getenv("PRICE_BATCH_MAX", "50"))
+# Prices of tokens with a broadcast inside its longest horizon are sampled every
+# PRICE_SAMPLE_INTERVAL seconds and variance is read from the samples; 0 falls back
+# to fetching prices when each check comes due.
+PRICE_SAMPLE_INTERVAL = float(os.getenv("PRICE_SAMPLE_INTERVAL", "2"))
+# "sync" polls and enriches one edge at a time; "async" enriches new edges concurrently;
+# "supervisor" forks one worker process per FEED_SHARDS entry and merges their rows here;
+# "backfill" walks the FEED_SHARDS feeds back through their cursors and exits.
+SCRAPER_MODE = sys.argv[1] if len(sys.argv) > 1 else os.getenv("SCRAPER_MODE", "sync")
+# JSON list of feed shards; each overrides mode/sortOrder and any feedV3 filter of the
+# default ForYou/Newest/Buy feed, e.g. [{"direction": "Buy"}, {"direction": "Sell"}].
+FEED_SHARDS = json.loads(os.getenv("FEED_SHARDS", '[{"direction": "Buy"}]'))
+ROW_QUEUE_SIZE = int(os.getenv("ROW_QUEUE_SIZE", "1000"))
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "8"))
+# Profiles and tokens for new broadcasts are fetched as one aliased document per
+# ENRICH_BATCH_MAX broadcasts; ENRICH_BATCH=0 goes back to one request per lookup.
+ENRICH_BATCH = os.getenv("ENRICH_BATCH", "1") == "1"
+ENRICH_BATCH_MAX = int(os.getenv("ENRICH_BATCH_MAX", "20"))
+# A broadcast whose enrichment failed is tried again with the next polls, up to this many times.
+ENRICH_RETRY_LIMIT = int(os.getenv("ENRICH_RETRY_LIMIT", "5"))
+# Delta polling pages back to the newest already-seen broadcast and adapts the
+# poll interval to feed activity instead of fetching first=10 every second.
+DELTA_POLLING = os.getenv("DELTA_POLLING", "0") == "1"
+POLL_PAGE_SIZE = int(os.getenv("POLL_PAGE_SIZE", "20"))
+POLL_MAX_PAGES = int(os.getenv("POLL_MAX_PAGES", "5"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "0.5"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "10"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "1.5"))
+# Scan feed pages as they stream in and stop at the first already-seen broadcast;
+# FEED_STREAMING=0 parses each page in full first.
+FEED_STREAMING = os.getenv("FEED_STREAMING", "1") == "1"
+# Profiles older than the TTL are still served while a background refresh runs.
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "5000"))
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "60"))
+# Static token metadata is kept until evicted and revalidated in the background after this long.
+TOKEN_STATIC_REVALIDATE = float(os.getenv("TOKEN_STATIC_REVALIDATE", "3600"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+TOKEN_CACHE_FILE = os.getenv("TOKEN_CACHE_FILE", "token_static_cache.json")
+# Ids seen within SEEN_WINDOW seconds are tracked exactly; older ones only in a Bloom filter.
+SEEN_WINDOW = float(os.getenv("SEEN_WINDOW", "3600"))
+SEEN_MAX_RECENT = int(os.getenv("SEEN_MAX_RECENT", "100000"))
+SEEN_CAPACITY = int(os.getenv("SEEN_CAPACITY", "2000000"))
+SEEN_ERROR_RATE = float(os.getenv("SEEN_ERROR_RATE", "1e-5"))
+# Rows written this recently that still miss a horizon are indexed as pending at startup.
+PENDING_WINDOW = float(os.getenv("PENDING_WINDOW", "600"))
+# Backfill runs one cursor stream per FEED_SHARDS entry, BACKFILL_PAGE_SIZE edges a page,
+# until the feed ends, BACKFILL_MAX_PAGES pages per run (0: no limit) or a broadcast created before
+# BACKFILL_SINCE_MS (epoch ms, 0: no limit). Each shard's cursor is checkpointed once its
+# rows are stored, so a restarted backfill continues where it stopped.
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "50"))
+BACKFILL_MAX_PAGES = int(os.getenv("BACKFILL_MAX_PAGES", "0"))
+BACKFILL_SINCE_MS = int(os.getenv("BACKFILL_SINCE_MS", "0"))
+BACKFILL_RETRY_DELAY = float(os.getenv("BACKFILL_RETRY_DELAY", "5"))
+# Journaled checks that came due while the scraper was down are run at startup if they
+# are at most this many seconds late, and marked expired otherwise.
+HORIZON_EXPIRE_AFTER = float(os.getenv("HORIZON_EXPIRE_AFTER", "120"))
+
+# (seconds after the broadcast is seen, variance column, won column)
+HORIZONS = [
+    (30, "price_30s_variance", "won_30s"),
+    (60, "price_1m_variance", "won_1m"),
+    (300, "price_5m_variance", "won_5m"),
+]
 
-seen_broadcast_ids = set()
 broadcast_data_dict = {}
 
-# Ensure CSV file and header
-if not os.path.exists(output_file):
-    print("CSV file does not exist. Creating now...")
-    with open(output_file, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        writer.writeheader()
-    print("CSV file created with header.")
+variance_columns = [field_name_var for _, field_name_var, _ in HORIZONS]
+startup_began = time.time()
+if STORAGE_BACKEND == "sqlite":
+    store = SqliteRowStore(SQLITE_PATH, columns, export_path=output_file, export_interval=COMPACT_INTERVAL,
+                           tracked_columns=variance_columns)
+    if store.count() == 0 and os.path.exists(output_file):
+        log.info("Importing existing rows from %s into %s...", output_file, SQLITE_PATH)
+        log.info("Imported %d rows.", store.import_csv(output_file))
+    # Bloom hits are confirmed by primary key, so a false positive never skips a new broadcast.
+    seen_broadcast_ids = SeenIds(window=SEEN_WINDOW, max_recent=SEEN_MAX_RECENT, capacity=SEEN_CAPACITY,
+                                 error_rate=SEEN_ERROR_RATE, confirm=store.contains)
+    seen_snapshot_file = SQLITE_PATH + ".seen"
+    horizon_journal_file = SQLITE_PATH + ".horizons"
+    backfill_checkpoint_file = SQLITE_PATH + ".backfill"
 else:
-    print("CSV file already exists. Reading existing rows to avoid duplicates...")
-    with open(output_file, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            broadcast_id = row.get("broadcast_id")
-            if broadcast_id:
-                seen_broadcast_ids.add(broadcast_id)
-                broadcast_data_dict[broadcast_id] = row
-    print(f"Loaded {len(seen_broadcast_ids)} existing broadcasts from CSV.")
-
-
-def fetch_broadcasts(page_cursor=None, first=10):
-    print("Fetching broadcasts from API...")
-    query = """
+    # Ensure CSV file and header
+    if not os.path.exists(output_file):
+        log.info("CSV file does not exist. Creating now...")
+    store = RowStore(output_file, columns, compact_interval=COMPACT_INTERVAL, compact_patch_ratio=COMPACT_PATCH_RATIO,
+                     tracked_columns=variance_columns)
+    # Bloom hits are confirmed against the row index, so a false positive never skips a new broadcast.
+    seen_broadcast_ids = SeenIds(window=SEEN_WINDOW, max_recent=SEEN_MAX_RECENT, capacity=SEEN_CAPACITY,
+                                 error_rate=SEEN_ERROR_RATE, confirm=store.contains)
+    seen_snapshot_file = output_file + ".seen"
+    horizon_journal_file = output_file + ".horizons"
+    backfill_checkpoint_file = output_file + ".backfill"
+
+# Startup reads the seen-id snapshot plus whatever the store indexed after it, and
+# the index tail for rows still missing a horizon; full rows stay on disk until needed.
+replayed = 0
+for broadcast_id in store.ids_since(seen_broadcast_ids.load(seen_snapshot_file)):
+    seen_broadcast_ids.add(broadcast_id, recent=False)
+    replayed += 1
+pending_count = store.load_pending(PENDING_WINDOW)
+log.info("Loaded %d existing broadcast ids (%d replayed since the last snapshot), %d incomplete, in %.2fs.",
+         len(seen_broadcast_ids), replayed, pending_count, time.time() - startup_began)
+
+
+# Snapshots are written from the checkpoint and compactor threads and at exit; they share
+# temp file names, so only one is written at a time.
+checkpoint_lock = threading.Lock()
+
+
+def checkpoint_seen_ids():
+    with checkpoint_lock:
+        seen_broadcast_ids.dump(seen_snapshot_file, store.index_position())
+
+
+# atexit runs in reverse order: compact first, then snapshot against the compacted index.
+atexit.register(checkpoint_seen_ids)
+atexit.register(store.compact)
+
+
+FEED_QUERY = """
     query FeedListsQuery($mode: FeedMode!, $sortOrder: FeedSortOrder!, $filters: FeedFilters, $after: String, $first: Int) {
       feedV3(mode: $mode, sortOrder: $sortOrder, filters: $filters, after: $after, first: $first) {
         edges {
@@ -150,30 +294,125 @@ def fetch_broadcasts(page_cursor=None, first=10):
       }
     }
     """
-    variables = {
+
+EDGE_ID_RE = re.compile(rb'"broadcast"\s*:\s*\{\s*"id"\s*:\s*"([^"\\]*)"')
+
+
+def make_shard(overrides=None):
+    shard = {
         "mode": "ForYou",
         "sortOrder": "Newest",
-        "after": page_cursor,
         "filters": {
             "bcastMCap": None,
             "direction": "Buy",
             "lookbackMs": None,
             "tradeSize": None,
         },
+    }
+    for key, value in (overrides or {}).items():
+        if key in ("mode", "sortOrder"):
+            shard[key] = value
+        else:
+            shard["filters"][key] = value
+    return shard
+
+
+# The feed this process polls; supervisor workers replace it with their own shard.
+feed_shard = make_shard()
+
+
+def feed_variables(page_cursor=None, first=10, shard=None):
+    shard = shard or feed_shard
+    return {
+        "mode": shard["mode"],
+        "sortOrder": shard["sortOrder"],
+        "after": page_cursor,
+        "filters": dict(shard["filters"]),
         "first": first
     }
 
-    response = requests.post(GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=HEADERS, verify=False)
-    data = response.json() or {}
-    print("Fetch complete.")
-    return data.get('data', {}).get('feedV3', {})
 
+def fetch_broadcasts(page_cursor=None, first=10, shard=None):
+    log.debug("Fetching broadcasts from API...")
+    data = client.execute(FEED_QUERY, feed_variables(page_cursor, first, shard))
+    log.debug("Fetch complete.")
+    return data.get('feedV3') or {}
 
-def fetch_user_profile(username):
-    print(f"Fetching user profile for {username}...")
-    query = """
-    query UsernameProfileQuery($username: String!, $yourProfileId: String!) {
-      profile(username: $username) {
+
+def stream_broadcasts(is_known, page_cursor=None, first=10):
+    # Edges are scanned off the wire one at a time and the broadcast id is read from
+    # the raw bytes (id is the first field of broadcast), so known edges are never
+    # decoded and the rest of the page is dropped as soon as one shows up.
+    # Returns (new edges, pageInfo, whether a known broadcast was reached).
+    log.debug("Streaming broadcasts from API...")
+    new_edges = []
+    page_info = {}
+    with client.stream(FEED_QUERY, feed_variables(page_cursor, first)) as chunks:
+        for kind, value in iter_array_items(chunks, "edges", ("pageInfo",)):
+            if kind == "item":
+                match = EDGE_ID_RE.search(value)
+                if match is not None and is_known(match.group(1).decode("utf-8")):
+                    log.debug("Stopped reading the page at known broadcast after %d new.", len(new_edges))
+                    return new_edges, page_info, True
+                edge = json.loads(value)
+                broadcast = (edge.get('node') or {}).get('broadcast') or {}
+                if match is None and is_known(broadcast.get("id", "")):
+                    return new_edges, page_info, True
+                new_edges.append(edge)
+            elif kind == "pageInfo":
+                page_info = value or {}
+            else:
+                # No edges in the body at all: null data raises, an empty feed is just empty.
+                feed = response_data(value, operation_name(FEED_QUERY)).get('feedV3') or {}
+                return [], feed.get('pageInfo') or {}, False
+    log.debug("Fetch complete.")
+    return new_edges, page_info, False
+
+
+def fetch_new_edges(is_known, first=10, max_pages=5):
+    # The feed is newest-first, so everything after the first known broadcast has
+    # already been seen. Keep paging until we reach one so bursts are never cut off.
+    new_edges = []
+    page_cursor = None
+    for _ in range(max_pages):
+        if FEED_STREAMING:
+            edges, page_info, reached_known = stream_broadcasts(is_known, page_cursor=page_cursor, first=first)
+            new_edges.extend(edges)
+            if reached_known:
+                return new_edges
+        else:
+            page = fetch_broadcasts(page_cursor=page_cursor, first=first)
+            for edge in page.get('edges') or []:
+                broadcast = (edge.get('node') or {}).get('broadcast') or {}
+                if is_known(broadcast.get("id", "")):
+                    return new_edges
+                new_edges.append(edge)
+            page_info = page.get('pageInfo') or {}
+        page_cursor = page_info.get('endCursor')
+        if not page_info.get('hasNextPage') or not page_cursor:
+            return new_edges
+    log.info("Stopped delta poll after %d pages without reaching a known broadcast.", max_pages)
+    return new_edges
+
+
+def next_poll_interval(interval, new_count):
+    if new_count == 0:
+        return min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    if new_count >= POLL_PAGE_SIZE:
+        return POLL_MIN_INTERVAL
+    return max(interval / 2, POLL_MIN_INTERVAL)
+
+
+def poll_edges(is_known):
+    with stage_latency.time(stage="feed_poll"):
+        if DELTA_POLLING:
+            return fetch_new_edges(is_known, first=POLL_PAGE_SIZE, max_pages=POLL_MAX_PAGES)
+        if FEED_STREAMING:
+            return stream_broadcasts(is_known, first=10)[0]
+        return fetch_broadcasts(first=10).get('edges') or []
+
+
+PROFILE_FIELDS = """
         id
         username
         twitterUsername
@@ -212,27 +451,28 @@ def fetch_user_profile(username):
         subscribedByProfileV2(profileId: $yourProfileId)
         subscriberCountV2
         followedByProfile(profileId: $yourProfileId)
-      }
+"""
+
+
+def fetch_user_profile(username):
+    log.debug("Fetching user profile for %s...", username)
+    query = """
+    query UsernameProfileQuery($username: String!, $yourProfileId: String!) {
+      profile(username: $username) {%s      }
     }
-    """
+    """ % PROFILE_FIELDS
     variables = {
         "username": username,
         "yourProfileId": YOUR_PROFILE_ID
     }
 
-    response = requests.post(GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=HEADERS, verify=False)
-    print(f"Profile fetch for {username} complete.")
-    data = response.json() or {}
-    return data.get('data', {}).get('profile', {}) or {}
+    data = client.execute(query, variables)
+    log.debug("Profile fetch for %s complete.", username)
+    # None (no such profile, or an error) is not cached, so the next lookup asks again.
+    return data.get('profile')
 
 
-def fetch_token_data(token_id):
-    if not token_id:
-        return {}
-    print(f"Fetching token data for {token_id}...")
-    query = """
-    query tokenScreenQuery($id: ID!) {
-      token(id: $id) {
+TOKEN_STATIC_FIELDS = """
         image
         chain
         id
@@ -240,17 +480,24 @@ def fetch_token_data(token_id):
         decimals
         name
         symbol
-        price
         supply
         verified
         jupVerified
         mintAuthority
         freezable
-        liquidity
         exchPumpFun
         exchMoonshot
         exchRaydium
         exchMeteora
+        twitter
+        telegram
+        website
+        discord
+"""
+
+TOKEN_MARKET_FIELDS = """
+        price
+        liquidity
         volume24h
         volume6h
         volume1h
@@ -272,283 +519,495 @@ def fetch_token_data(token_id):
         sellCount1h
         buyCount5min
         sellCount5min
-        twitter
-        telegram
-        website
-        discord
         top10HolderPercent
         top10HolderPercentV2
-      }
+"""
+
+
+def fetch_token_static(token_id):
+    if not token_id:
+        return {}
+    log.debug("Fetching static token metadata for %s...", token_id)
+    query = """
+    query tokenStaticQuery($id: ID!) {
+      token(id: $id) {%s      }
     }
-    """
+    """ % TOKEN_STATIC_FIELDS
     variables = {"id": token_id}
-    response = requests.post(GRAPHQL_ENDPOINT, json={"query": query, "variables": variables}, headers=HEADERS, verify=False)
-    print(f"Token data fetch for {token_id} complete.")
-    data = response.json() or {}
-    return data.get('data', {}).get('token', {}) or {}
-
-
-def rewrite_csv():
-    print("Rewriting CSV with updated data...")
-    with open(output_file, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        writer.writeheader()
-        for b_id, row_data in broadcast_data_dict.items():
-            writer.writerow(row_data)
-    print("CSV rewrite complete.")
-
-
-def compute_variance(buy_token_id, buy_price_bcast):
-    token_data_now = fetch_token_data(buy_token_id)
-    current_price = token_data_now.get("price", 0.0)
-    if buy_price_bcast != 0:
+    data = client.execute(query, variables)
+    log.debug("Static token metadata fetch for %s complete.", token_id)
+    return data.get('token')
+
+
+def fetch_token_market(token_id):
+    if not token_id:
+        return {}
+    log.debug("Fetching market data for %s...", token_id)
+    query = """
+    query tokenMarketQuery($id: ID!) {
+      token(id: $id) {%s      }
+    }
+    """ % TOKEN_MARKET_FIELDS
+    variables = {"id": token_id}
+    data = client.execute(query, variables)
+    log.debug("Market data fetch for %s complete.", token_id)
+    return data.get('token') or {}
+
+
+def fetch_token_data(token_id):
+    if not token_id:
+        return {}
+    with stage_latency.time(stage="token_lookup"):
+        token_data = dict(token_static_cache.get(token_id) or {})
+        token_data.update(fetch_token_market(token_id))
+    return token_data
+
+
+def lookup_profile(username):
+    with stage_latency.time(stage="profile_lookup"):
+        return profile_cache.get(username)
+
+
+def claim_lookup(kind, key, followed):
+    # True if this batch should fetch (kind, key) itself; otherwise the request of the
+    # batch already fetching it is remembered in followed and waited for afterwards.
+    if lookup_flights is None:
+        return True
+    call, leader = lookup_flights.begin((kind, key))
+    if not leader:
+        followed[(kind, key)] = call
+        lookups_coalesced.inc(kind=kind)
+    return leader
+
+
+def fetch_page_enrichment(broadcasts, market=True):
+    # Profiles and static token metadata are only asked for on a cache miss; market
+    # data is live and asked for every distinct buy token, unless market is False.
+    # Returns process_broadcasts items.
+    usernames = list(dict.fromkeys((broadcast.get("profile") or {}).get("username", "") for broadcast in broadcasts))
+    token_ids = list(dict.fromkeys(broadcast.get("buyTokenId", "") for broadcast in broadcasts))
+    token_ids = [token_id for token_id in token_ids if token_id]
+    doc = Document("PageEnrichmentQuery")
+    results = {"profile": {}, "static": {}, "market": {}}
+    profiles, statics, markets = results["profile"], results["static"], results["market"]
+    profile_aliases, static_aliases, market_aliases = {}, {}, {}
+    followed = {}
+    # Aliases are numbered per kind so documents repeat in shape and reuse the client's prepared templates.
+    for username in usernames:
+        found, profile = profile_cache.lookup(username)
+        if found:
+            profiles[username] = profile
+        elif claim_lookup("profile", username, followed):
+            profile_aliases[doc.field(f"p{len(profile_aliases)}", "profile", PROFILE_FIELDS, username=("String!", username))] = username
+    if profile_aliases:
+        doc.variable("yourProfileId", "String!", YOUR_PROFILE_ID)
+    for token_id in token_ids:
+        found, static = token_static_cache.lookup(token_id)
+        if found:
+            statics[token_id] = static
+        elif claim_lookup("static", token_id, followed):
+            static_aliases[doc.field(f"s{len(static_aliases)}", "token", TOKEN_STATIC_FIELDS, id=("ID!", token_id))] = token_id
+        if market and claim_lookup("market", token_id, followed):
+            market_aliases[doc.field(f"m{len(market_aliases)}", "token", TOKEN_MARKET_FIELDS, id=("ID!", token_id))] = token_id
+    led = [("profile", profile_aliases), ("static", static_aliases), ("market", market_aliases)]
+
+    data = {}
+    try:
+        if len(doc):
+            log.debug("Fetching %d profiles and %d tokens (%d uncached) for %d broadcasts in one request...",
+                      len(profile_aliases), len(market_aliases), len(static_aliases), len(broadcasts))
+            data = client.execute(doc.render(), doc.variables)
+            log.debug("Page enrichment fetch complete.")
+    except BaseException as e:
+        if lookup_flights is not None:
+            for kind, aliases in led:
+                for key in aliases.values():
+                    lookup_flights.fail((kind, key), e)
+        raise
+    for kind, aliases in led:
+        for alias, key in aliases.items():
+            value = data.get(alias)
+            # A null alias (unknown key, or an error on that field) serves this page but is never cached.
+            if value is not None and kind == "profile":
+                profile_cache.put(key, value)
+            elif value is not None and kind == "static":
+                token_static_cache.put(key, value)
+            results[kind][key] = value or {}
+            if lookup_flights is not None:
+                lookup_flights.finish((kind, key), results[kind][key])
+    for (kind, key), call in followed.items():
+        results[kind][key] = call.wait()
+
+    items = []
+    for broadcast in broadcasts:
+        username = (broadcast.get("profile") or {}).get("username", "")
+        token_id = broadcast.get("buyTokenId", "")
+        token_data = {}
+        if token_id:
+            # Same merge as fetch_token_data: static metadata overlaid with market data.
+            token_data = dict(statics.get(token_id) or {})
+            token_data.update(markets.get(token_id) or {})
+        items.append((broadcast, profiles.get(username) or {}, token_data))
+    return items
+
+
+def enrich_chunk(broadcasts, market=True):
+    with stage_latency.time(stage="page_enrichment"):
+        return fetch_page_enrichment(broadcasts, market)
+
+
+def enrich_page(broadcasts, pool=None, market=True):
+    # With a pool the ENRICH_BATCH_MAX-sized chunks of the page are fetched concurrently.
+    chunks = [broadcasts[i:i + ENRICH_BATCH_MAX] for i in range(0, len(broadcasts), ENRICH_BATCH_MAX)]
+    markets = [market] * len(chunks)
+    results = pool.map(enrich_chunk, chunks, markets) if pool is not None else map(enrich_chunk, chunks, markets)
+    return [item for items in results for item in items]
+
+
+# Broadcasts whose enrichment failed, by id: [broadcast, failures]. Polls stop reading the
+# feed at the first known broadcast, so once newer ones are stored above a failed one the
+# feed never shows it again; it is retried from here instead.
+failed_broadcasts = {}
+
+
+def retry_later(broadcasts):
+    for broadcast in broadcasts:
+        b_id = broadcast.get("id", "")
+        entry = failed_broadcasts.setdefault(b_id, [broadcast, 0])
+        entry[1] += 1
+        if entry[1] > ENRICH_RETRY_LIMIT:
+            log.warning("Giving up on broadcast %s after %d failed enrichments.", b_id, entry[1])
+            del failed_broadcasts[b_id]
+
+
+def take_retries(skip):
+    # Failed broadcasts to try again, minus those stored since and those in ``skip``.
+    retries = []
+    for b_id, (broadcast, _) in list(failed_broadcasts.items()):
+        if b_id in seen_broadcast_ids:
+            del failed_broadcasts[b_id]
+        elif b_id not in skip:
+            retries.append(broadcast)
+    return retries
+
+
+def fetch_token_prices(token_ids):
+    token_ids = list(dict.fromkeys(t for t in token_ids if t))
+    if not token_ids:
+        return {}
+    log.debug("Fetching prices for %d tokens...", len(token_ids))
+    # One aliased document asking only for price: t0: token(id: $t0_id) { price } ...
+    doc = Document("TokenPricesQuery")
+    aliases = [doc.field(f"t{i}", "token", " price ", id=("ID!", token_id)) for i, token_id in enumerate(token_ids)]
+    data = client.execute(doc.render(), doc.variables)
+    log.debug("Price fetch for %d tokens complete.", len(token_ids))
+    return {token_id: (data.get(alias) or {}).get("price") for alias, token_id in zip(aliases, token_ids)}
+
+
+def compute_variance(buy_price_bcast, current_price):
+    current_price = current_price or 0.0
+    if buy_price_bcast:
         return ((current_price - buy_price_bcast) / buy_price_bcast) * 100.0
     else:
         return 0.0
 
-def set_variance_and_won(b_id, field_name_var, field_name_won, variance):
-    if b_id in broadcast_data_dict:
-        broadcast_data_dict[b_id][field_name_var] = variance
-        broadcast_data_dict[b_id][field_name_won] = True if variance > 25 else False
-        print(f"{field_name_var} for {b_id}: {variance:.2f}% (won: {broadcast_data_dict[b_id][field_name_won]})")
-        rewrite_csv()
+def get_row(b_id):
+    row = broadcast_data_dict.get(b_id)
+    if row is None:
+        # Rows from before a restart are only read back when a pending update needs them.
+        row = store.get(b_id)
+        if row is not None:
+            row = BroadcastRow.from_text(row)
+            broadcast_data_dict[b_id] = row
+    return row
+
+
+def set_variance_and_won(b_id, field_name_var, field_name_won, variance, extra=None):
+    if get_row(b_id) is not None:
+        won = True if variance > 25 else False
+        fields = {field_name_var: variance, field_name_won: won}
+        fields.update(extra or {})
+        broadcast_data_dict[b_id].update(fields)
+        log.debug("%s for %s: %.2f%% (won: %s)", field_name_var, b_id, variance, won)
+        with stage_latency.time(stage="store_patch"):
+            store.patch(b_id, fields)
+        if all(broadcast_data_dict[b_id][field] is not None for _, field, _ in HORIZONS):
+            # Every horizon is persisted; nothing will touch this row again.
+            del broadcast_data_dict[b_id]
     else:
-        print(f"Broadcast {b_id} not found in dictionary at {field_name_var} update time.")
+        log.warning("Broadcast %s not found in dictionary at %s update time.", b_id, field_name_var)
 
 
-def timed_variance_update(b_id, buy_token_id, buy_price_bcast, wait_time, field_name_var, field_name_won):
-    print(f"Scheduling {field_name_var} update in {wait_time} seconds for broadcast {b_id}...")
-    time.sleep(wait_time)
-    print(f"Computing {field_name_var} for {b_id}...")
-    variance = compute_variance(buy_token_id, buy_price_bcast)
-    set_variance_and_won(b_id, field_name_var, field_name_won, variance)
+lookup_flights = SingleFlight() if SINGLE_FLIGHT else None
+profile_cache = TTLCache(fetch_user_profile, ttl=PROFILE_CACHE_TTL, maxsize=PROFILE_CACHE_SIZE, name="profile")
+token_static_cache = TTLCache(fetch_token_static, ttl=TOKEN_STATIC_REVALIDATE, maxsize=TOKEN_CACHE_SIZE, name="token")
+registry.gauge("rows_pending_variance", "Rows held in memory until every horizon is filled.",
+               callback=lambda: len(broadcast_data_dict))
+registry.gauge("variance_checks_pending", "Variance checks waiting in the scheduler.",
+               callback=lambda: scheduler.pending())
+registry.gauge("seen_ids", "Broadcast ids tracked for dedup.", callback=lambda: len(seen_broadcast_ids))
+registry.gauge("cache_entries", "Entries per lookup cache.", ["cache"],
+               callback=lambda: {("profile",): profile_cache.stats()["size"],
+                                 ("token",): token_static_cache.stats()["size"]})
+enrich_queue_depth = registry.gauge("enrich_queue_depth", "Async mode: enriched broadcasts waiting for the row writer.")
+enrich_in_flight = registry.gauge("enrich_in_flight", "Async mode: broadcasts being enriched.")
+log.info("Loaded %d tokens from %s.", token_static_cache.load(TOKEN_CACHE_FILE), TOKEN_CACHE_FILE)
 
 
-def schedule_updates(b_id, buy_token_id, buy_price_bcast):
-    print(f"Starting update schedule for broadcast {b_id}...")
-    # 30s update
-    timed_variance_update(b_id, buy_token_id, buy_price_bcast, 30, "price_30s_variance", "won_30s")
-    # 1m update (another 30s from now)
-    timed_variance_update(b_id, buy_token_id, buy_price_bcast, 30, "price_1m_variance", "won_1m")
-    # 5m update (another 4 minutes)
-    timed_variance_update(b_id, buy_token_id, buy_price_bcast, 240, "price_5m_variance", "won_5m")
-    print(f"All updates complete for broadcast {b_id}.")
-
-
-def process_broadcast(broadcast, buy_token_data):
-    b_id = broadcast.get("id", "")
-    if b_id in seen_broadcast_ids:
-        print(f"Broadcast {b_id} already seen. Skipping.")
+def dump_token_cache():
+    with checkpoint_lock:
+        token_static_cache.dump(TOKEN_CACHE_FILE)
+
+
+atexit.register(dump_token_cache)
+last_stats_report = time.time()
+
+
+def report_stats():
+    global last_stats_report
+    if time.time() - last_stats_report < STATS_INTERVAL:
         return
-    seen_broadcast_ids.add(b_id)
-    print(f"Processing new broadcast {b_id}...")
+    last_stats_report = time.time()
+    for label, cache in (("Profile", profile_cache), ("Token", token_static_cache)):
+        stats = cache.stats()
+        log.info("%s cache: %d entries, %d hits, %d stale hits, %d misses, %d refreshes, hit rate %.1f%%",
+                 label, stats['size'], stats['hits'], stats['stale_hits'], stats['misses'], stats['refreshes'],
+                 stats['hit_rate'] * 100)
+    if price_sampler:
+        sampler = price_sampler.stats()
+        log.info("Price sampler: %d active tokens, %d samples over %d rounds",
+                 sampler['active'], sampler['samples'], sampler['rounds'])
+    if lookup_flights is not None:
+        flights = lookup_flights.stats()
+        log.info("Enrichment lookups: %d fetched, %d shared with a batch in flight", flights['leaders'], flights['shared'])
+    seen = seen_broadcast_ids.stats()
+    log.info("Seen ids: %d total, %d recent, %d rows pending variance", seen['total'], seen['recent'],
+             len(broadcast_data_dict))
+    conn = client.connection_stats()
+    log.info("HTTP pool: %d requests over %d connections, reuse rate %.1f%%, %d body bytes sent, "
+             "%d persisted query misses, %d coalesced, concurrency limit %s", conn['requests'], conn['connections'],
+             conn['reuse_rate'] * 100, conn['bytes_sent'], conn['persisted_misses'], conn['coalesced'], conn['limit'])
 
-    b_created_at = broadcast.get("createdAt", "")
-    b_profile = broadcast.get("profile") or {}
-    b_user_id = b_profile.get("id", "")
-    b_user_username = b_profile.get("username", "")
-    b_buy_token_id = broadcast.get("buyTokenId", "")
-    b_buy_token_amount = broadcast.get("buyTokenAmount", 0)
-    b_buy_token_price_bcast = broadcast.get("buyTokenPrice", 0.0)
-    b_buy_token_mcap_bcast = broadcast.get("buyTokenMCap", 0.0)
-    b_sell_token_id = broadcast.get("sellTokenId", "")
-    b_sell_token_amount = broadcast.get("sellTokenAmount", 0)
-    b_sell_token_price_bcast = broadcast.get("sellTokenPrice", 0.0)
-    b_sell_token_mcap_bcast = broadcast.get("sellTokenMCap", 0.0)
-
-    user_data = fetch_user_profile(b_user_username) or {}
-    u_twitter = user_data.get("twitterUsername", None)
-    u_visibility = user_data.get("visibility", "PUBLIC")
-    u_is_verified = user_data.get("isVerified", False)
-    u_follower_count = user_data.get("followerCount", 0)
-    u_followee_count = user_data.get("followeeCount", 0)
-    u_mutual = user_data.get("mutualFollowersV2") or {}
-    u_mutual_count = u_mutual.get("totalCount", 0)
-
-    u_weekly = user_data.get("weeklyLeaderboardStanding") or {}
-    u_weekly_rank = u_weekly.get("rank", None)
-    u_weekly_value = u_weekly.get("value", 0.0)
-
-    u_best_ever = user_data.get("bestEverStanding") or {}
-    u_best_rank = u_best_ever.get("rank", None)
-    u_best_rank_value = u_best_ever.get("value", 0.0)
-
-    u_top_win = user_data.get("topThreePnlWin", []) or []
-    u_top_loss = user_data.get("topThreePnlLoss", []) or []
-    u_top_vol = user_data.get("topThreeVolume", []) or []
-
-    u_plv = user_data.get("profileLeaderboardValues") or {}
-    u_daily = u_plv.get("daily") or {}
-    u_weekly_vals = u_plv.get("weekly") or {}
-
-    u_daily_pnl = u_daily.get("pnl", 0.0)
-    u_daily_volume = u_daily.get("volume", 0.0)
-
-    u_w_pnl = u_weekly_vals.get("pnl", 0.0)
-    u_w_volume = u_weekly_vals.get("volume", 0.0)
-
-    u_subscriber_count = user_data.get("subscriberCountV2", 0)
-    u_followed_by_you = user_data.get("followedByProfile", False)
-    u_subscribed_by_you = user_data.get("subscribedByProfileV2", False)
-
-    bt_name = buy_token_data.get("name", "")
-    bt_symbol = buy_token_data.get("symbol", "")
-    bt_price = buy_token_data.get("price", 0.0)
-    bt_supply = buy_token_data.get("supply", 0)
-    bt_chain = buy_token_data.get("chain", "")
-    bt_liquidity = buy_token_data.get("liquidity", 0)
-    bt_verified = buy_token_data.get("verified", False)
-    bt_jupVerified = buy_token_data.get("jupVerified", False)
-    bt_freezable = buy_token_data.get("freezable", False)
-
-    bt_twitter = buy_token_data.get("twitter", None)
-    bt_telegram = buy_token_data.get("telegram", None)
-    bt_website = buy_token_data.get("website", None)
-    bt_discord = buy_token_data.get("discord", None)
-
-    bt_volume24h = buy_token_data.get("volume24h", 0.0)
-    bt_volume6h = buy_token_data.get("volume6h", 0.0)
-    bt_volume1h = buy_token_data.get("volume1h", 0.0)
-    bt_volume5min = buy_token_data.get("volume5min", 0.0)
-
-    bt_buyVolume24h = buy_token_data.get("buyVolume24h", 0.0)
-    bt_sellVolume24h = buy_token_data.get("sellVolume24h", 0.0)
-    bt_buyVolume6h = buy_token_data.get("buyVolume6h", 0.0)
-    bt_sellVolume6h = buy_token_data.get("sellVolume6h", 0.0)
-    bt_buyVolume1h = buy_token_data.get("buyVolume1h", 0.0)
-    bt_sellVolume1h = buy_token_data.get("sellVolume1h", 0.0)
-    bt_buyVolume5min = buy_token_data.get("buyVolume5min", 0.0)
-    bt_sellVolume5min = buy_token_data.get("sellVolume5min", 0.0)
-
-    bt_buyCount24h = buy_token_data.get("buyCount24h", 0)
-    bt_sellCount24h = buy_token_data.get("sellCount24h", 0)
-    bt_buyCount6h = buy_token_data.get("buyCount6h", 0)
-    bt_sellCount6h = buy_token_data.get("sellCount6h", 0)
-    bt_buyCount1h = buy_token_data.get("buyCount1h", 0)
-    bt_sellCount1h = buy_token_data.get("sellCount1h", 0)
-    bt_buyCount5min = buy_token_data.get("buyCount5min", 0)
-    bt_sellCount5min = buy_token_data.get("sellCount5min", 0)
-
-    bt_top10Percent = buy_token_data.get("top10HolderPercent", 0.0)
-    bt_top10PercentV2 = buy_token_data.get("top10HolderPercentV2", 0.0)
-
-    row_data = {
-        "broadcast_id": b_id,
-        "created_at": b_created_at,
-        "user_id": b_user_id,
-        "user_username": b_user_username,
-        "buy_token_id": b_buy_token_id,
-        "buy_token_amount": b_buy_token_amount,
-        "buy_token_price_bcast": b_buy_token_price_bcast,
-        "buy_token_mcap_bcast": b_buy_token_mcap_bcast,
-        "sell_token_id": b_sell_token_id,
-        "sell_token_amount": b_sell_token_amount,
-        "sell_token_price_bcast": b_sell_token_price_bcast,
-        "sell_token_mcap_bcast": b_sell_token_mcap_bcast,
-        "broadcast_has_buy_token": 1 if b_buy_token_id else 0,
-        "broadcast_has_sell_token": 1 if b_sell_token_id else 0,
-        "user_twitter_username": u_twitter,
-        "user_is_verified": u_is_verified,
-        "user_is_verified_binary": 1 if u_is_verified else 0,
-        "user_follower_count": u_follower_count,
-        "user_followee_count": u_followee_count,
-        "user_mutual_follower_count": u_mutual_count,
-        "user_mutual_followers_binary": 1 if u_mutual_count > 0 else 0,
-        "user_visibility": u_visibility,
-        "user_visible_public": 1 if u_visibility == "PUBLIC" else 0,
-        "user_weekly_rank": u_weekly_rank,
-        "user_weekly_value": u_weekly_value,
-        "user_weekly_rank_is_top100": 1 if (u_weekly_rank and u_weekly_rank <= 100) else 0,
-        "user_best_rank": u_best_rank,
-        "user_best_rank_value": u_best_rank_value,
-        "user_best_rank_is_top100": 1 if (u_best_rank and u_best_rank <= 100) else 0,
-        "user_top_three_pnl_win_total": sum(u_top_win) if u_top_win else 0,
-        "user_top_three_pnl_loss_total": sum(u_top_loss) if u_top_loss else 0,
-        "user_top_three_volume_total": sum(u_top_vol) if u_top_vol else 0,
-        "user_daily_pnl": u_daily_pnl,
-        "user_daily_volume": u_daily_volume,
-        "user_weekly_pnl": u_w_pnl,
-        "user_weekly_volume": u_w_volume,
-        "user_subscriber_count": u_subscriber_count,
-        "user_has_subscribers": 1 if u_subscriber_count > 0 else 0,
-        "user_followed_by_you": u_followed_by_you,
-        "user_followed_by_you_binary": 1 if u_followed_by_you else 0,
-        "user_subscribed_by_you": u_subscribed_by_you,
-        "user_subscribed_by_you_binary": 1 if u_subscribed_by_you else 0,
-        "user_has_twitter": 1 if u_twitter else 0,
-        "buy_token_name": bt_name,
-        "buy_token_symbol": bt_symbol,
-        "buy_token_price": bt_price,
-        "buy_token_supply": bt_supply,
-        "buy_token_chain": bt_chain,
-        "buy_token_liquidity": bt_liquidity,
-        "buy_token_has_liquidity": 1 if bt_liquidity and bt_liquidity > 0 else 0,
-        "buy_token_volume24h": bt_volume24h,
-        "buy_token_volume6h": bt_volume6h,
-        "buy_token_volume1h": bt_volume1h,
-        "buy_token_volume5min": bt_volume5min,
-        "buy_token_buyVolume24h": bt_buyVolume24h,
-        "buy_token_sellVolume24h": bt_sellVolume24h,
-        "buy_token_buyVolume6h": bt_buyVolume6h,
-        "buy_token_sellVolume6h": bt_sellVolume6h,
-        "buy_token_buyVolume1h": bt_buyVolume1h,
-        "buy_token_sellVolume1h": bt_sellVolume1h,
-        "buy_token_buyVolume5min": bt_buyVolume5min,
-        "buy_token_sellVolume5min": bt_sellVolume5min,
-        "buy_token_buyCount24h": bt_buyCount24h,
-        "buy_token_sellCount24h": bt_sellCount24h,
-        "buy_token_buyCount6h": bt_buyCount6h,
-        "buy_token_sellCount6h": bt_sellCount6h,
-        "buy_token_buyCount1h": bt_buyCount1h,
-        "buy_token_sellCount1h": bt_sellCount1h,
-        "buy_token_buyCount5min": bt_buyCount5min,
-        "buy_token_sellCount5min": bt_sellCount5min,
-        "buy_token_verified": bt_verified,
-        "buy_token_is_verified": 1 if bt_verified else 0,
-        "buy_token_jupVerified": bt_jupVerified,
-        "buy_token_is_jupVerified": 1 if bt_jupVerified else 0,
-        "buy_token_freezable": bt_freezable,
-        "buy_token_is_freezable": 1 if bt_freezable else 0,
-        "buy_token_twitter": bt_twitter,
-        "buy_token_has_twitter": 1 if bt_twitter else 0,
-        "buy_token_telegram": bt_telegram,
-        "buy_token_has_telegram": 1 if bt_telegram else 0,
-        "buy_token_website": bt_website,
-        "buy_token_has_website": 1 if bt_website else 0,
-        "buy_token_discord": bt_discord,
-        "buy_token_has_discord": 1 if bt_discord else 0,
-        "buy_token_top10HolderPercent": bt_top10Percent,
-        "buy_token_top10HolderPercentV2": bt_top10PercentV2,
-        "price_30s_variance": None,
-        "price_1m_variance": None,
-        "price_5m_variance": None,
-        "won_30s": None,
-        "won_1m": None,
-        "won_5m": None
+
+summary_totals = {}
+
+
+def log_summary():
+    # One INFO line per interval in place of the per-broadcast DEBUG lines, built from
+    # counts the metrics already keep, so the hot path does no extra work for it.
+    totals = {
+        "new": broadcasts_seen.value(result="new"),
+        "duplicate": broadcasts_seen.value(result="duplicate"),
+        "polls": stage_latency.count(stage="feed_poll"),
+        "variance_updates": stage_latency.count(stage="store_patch"),
+        "requests": graphql_latency.count(),
+        "errors": graphql_errors.total(),
+        "retries": graphql_retries.total(),
+        "coalesced": graphql_coalesced.total() + lookups_coalesced.total(),
+    }
+    fields = {key: value - summary_totals.get(key, 0) for key, value in totals.items()}
+    summary_totals.update(totals)
+    fields.update(checks_pending=scheduler.pending(), rows_pending=len(broadcast_data_dict),
+                  concurrency_limit=client.limiter.stats()["limit"])
+    log.info("summary", extra={"fields": fields})
+
+
+def run_compactor():
+    # Compaction rewrites the whole output file, so it runs here rather than between polls.
+    while True:
+        time.sleep(1)
+        try:
+            with stage_latency.time(stage="compact"):
+                compacted = store.maybe_compact()
+            if compacted:
+                checkpoint_seen_ids()
+                log.info("Compacted storage.")
+        except Exception:
+            log.exception("Compaction failed")
+
+
+def run_checkpoints():
+    # Snapshots write whole files (the token cache as JSON of every entry), so they run here rather than between polls.
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            dump_token_cache()
+            checkpoint_seen_ids()
+        except Exception:
+            log.exception("Checkpoint failed")
+
+
+def run_log_summary():
+    while True:
+        time.sleep(LOG_SUMMARY_INTERVAL)
+        try:
+            log_summary()
+        except Exception:
+            log.exception("Summary failed")
+
+
+HORIZON_OFFSETS = {field_name_var: offset for offset, field_name_var, _ in HORIZONS}
+LONGEST_HORIZON = max(HORIZON_OFFSETS.values())
+
+
+def path_extremes(buy_token_id, buy_price_bcast, due):
+    # Peak of the sampled path over the longest horizon as a variance against the broadcast
+    # price, and its max drawdown (largest fall from a running peak, starting at the
+    # broadcast price) as a percentage.
+    if not price_sampler or not buy_price_bcast:
+        return {}
+    path = price_sampler.path(buy_token_id, due - LONGEST_HORIZON, due, buy_price_bcast)
+    if path is None:
+        return {}
+    high, drawdown = path
+    return {
+        "price_5m_peak_variance": compute_variance(buy_price_bcast, high),
+        "price_5m_max_drawdown": drawdown * 100.0,
     }
 
-    broadcast_data_dict[b_id] = row_data
-    print(f"New broadcast {b_id} added to dictionary. Rewriting CSV...")
-    rewrite_csv()
 
-    print(f"Spawning thread to schedule future variance updates for {b_id}...")
-    t = threading.Thread(target=schedule_updates, args=(b_id, b_buy_token_id, b_buy_token_price_bcast), daemon=True)
-    t.start()
-    print(f"Thread started for {b_id} updates.")
+def run_variance_checks(checks):
+    now = time.time()
+    for check in checks:
+        variance_lateness.observe(max(0.0, now - check[5]), horizon=check[3])
+    prices = {}
+    if price_sampler:
+        for b_id, buy_token_id, _, field_name_var, _, due in checks:
+            price = price_sampler.price_at(buy_token_id, due)
+            if price is not None:
+                prices[(b_id, field_name_var)] = price
+    # Only checks without a usable sample (sampling off, or resumed after a restart) hit the API.
+    missing = [check for check in checks if (check[0], check[3]) not in prices]
+    fetched = {}
+    token_ids = list(dict.fromkeys(check[1] for check in missing if check[1]))
+    try:
+        for i in range(0, len(token_ids), PRICE_BATCH_MAX):
+            fetched.update(fetch_token_prices(token_ids[i:i + PRICE_BATCH_MAX]))
+    except Exception as e:
+        # No price is better than a made-up one: retry while the check is within
+        # HORIZON_EXPIRE_AFTER of its due time, as a resumed check would be, then expire it.
+        retry = [check for check in missing if now - check[5] < HORIZON_EXPIRE_AFTER]
+        expired = [check for check in missing if now - check[5] >= HORIZON_EXPIRE_AFTER]
+        log.warning("Price fetch for %d variance checks failed (%s); retrying %d in %.0fs, %d expired.",
+                    len(missing), e, len(retry), VARIANCE_RETRY_DELAY, len(expired))
+        for check in retry:
+            scheduler.schedule(time.time() + VARIANCE_RETRY_DELAY, check)
+        release_rows(horizon_journal.expire(expired))
+        checks = [check for check in checks if (check[0], check[3]) in prices]
+        missing = []
+    for check in missing:
+        prices[(check[0], check[3])] = fetched.get(check[1])
+    for b_id, buy_token_id, buy_price_bcast, field_name_var, field_name_won, due in checks:
+        log.debug("Computing %s for %s...", field_name_var, b_id)
+        variance = compute_variance(buy_price_bcast, prices.get((b_id, field_name_var)))
+        extra = path_extremes(buy_token_id, buy_price_bcast, due) if HORIZON_OFFSETS[field_name_var] == LONGEST_HORIZON else {}
+        set_variance_and_won(b_id, field_name_var, field_name_won, variance, extra)
+    release_rows(horizon_journal.done(checks))
+
+
+def release_rows(b_ids):
+    # No check is left for these broadcasts, so nothing will patch them again even if an
+    # expired horizon left a column empty; stop holding them in memory and as pending.
+    for b_id in b_ids:
+        broadcast_data_dict.pop(b_id, None)
+    store.drop_pending(b_ids)
+
+
+def schedule_updates(b_id, buy_token_id, buy_price_bcast):
+    now = time.time()
+    # The due time travels with the check so lateness can be measured when it runs.
+    checks = [(b_id, buy_token_id, buy_price_bcast, field_name_var, field_name_won, now + offset)
+              for offset, field_name_var, field_name_won in HORIZONS]
+    # Journal first, so a check the scheduler has accepted is never lost to a restart.
+    horizon_journal.add(checks)
+    if price_sampler:
+        price_sampler.track(buy_token_id, now + LONGEST_HORIZON)
+    for check in checks:
+        log.debug("Scheduling %s update in %.0f seconds for broadcast %s...", check[3], check[5] - now, b_id)
+        scheduler.schedule(check[5], check)
+
+
+def resume_pending_checks():
+    pending = horizon_journal.load()
+    now = time.time()
+    overdue = [check for check in pending if check[5] <= now]
+    late = [check for check in overdue if now - check[5] <= HORIZON_EXPIRE_AFTER]
+    expired = [check for check in overdue if now - check[5] > HORIZON_EXPIRE_AFTER]
+    release_rows(horizon_journal.expire(expired))
+    if late:
+        # Everything that came due while stopped goes out as one batch of price requests.
+        scheduler.fire(late)
+    for check in pending[len(overdue):]:
+        scheduler.schedule(check[5], check)
+        if price_sampler:
+            price_sampler.track(check[1], check[5])
+    log.info("Resumed %d pending variance checks from %s (%d overdue run now, %d expired).",
+             len(pending) - len(expired), horizon_journal_file, len(late), len(expired))
+
+
+def build_new_rows(items, row_factory=None):
+    # items are (broadcast, user_data or None, buy_token_data); rows for the whole
+    # batch are built in one column-wise pass over the schema.
+    nodes = []
+    for broadcast, user_data, buy_token_data in items:
+        b_id = broadcast.get("id", "")
+        if b_id in seen_broadcast_ids:
+            log.debug("Broadcast %s already seen. Skipping.", b_id)
+            broadcasts_seen.inc(result="duplicate")
+            continue
+        seen_broadcast_ids.add(b_id)
+        broadcasts_seen.inc(result="new")
+        log.debug("Processing new broadcast %s...", b_id)
+        if user_data is None:
+            b_profile = broadcast.get("profile") or {}
+            user_data = lookup_profile(b_profile.get("username", "")) or {}
+        nodes.append({"broadcast": broadcast, "profile": user_data, "token": buy_token_data})
+    return build_rows(nodes, row_factory or BroadcastRow.from_dict)
+
+
+def store_rows(rows):
+    for row_data in rows:
+        b_id = row_data["broadcast_id"]
+        broadcast_data_dict[b_id] = row_data
+        log.debug("New broadcast %s added to dictionary. Appending to storage...", b_id)
+        with stage_latency.time(stage="store_append"):
+            store.append(row_data)
+        schedule_updates(b_id, row_data["buy_token_id"], row_data["buy_token_price_bcast"])
+
+
+def process_broadcasts(items):
+    store_rows(build_new_rows(items))
+
+
+def merge_rows(rows):
+    # Rows from shard workers: a broadcast can show up in several shards, so the
+    # writer's seen ids decide which copy is kept.
+    new_rows = []
+    for row_data in rows:
+        b_id = row_data["broadcast_id"]
+        if b_id in seen_broadcast_ids:
+            broadcasts_seen.inc(result="duplicate")
+            continue
+        seen_broadcast_ids.add(b_id)
+        broadcasts_seen.inc(result="new")
+        new_rows.append(BroadcastRow.from_dict(row_data))
+    store_rows(new_rows)
+
+
+def process_broadcast(broadcast, buy_token_data, user_data=None):
+    process_broadcasts([(broadcast, user_data, buy_token_data)])
 
 
-while True:
-    # Continuously fetch broadcasts every second
-    broadcasts_data = fetch_broadcasts(first=10)
-    edges = broadcasts_data.get('edges', [])
-    if edges is None:
-        edges = []
+def poll_sync():
+    edges = poll_edges(lambda b_id: b_id in seen_broadcast_ids)
+    new_count = 0
 
     if not edges:
-        print("No broadcasts found this iteration.")
+        log.debug("No broadcasts found this iteration.")
     else:
-        print(f"Fetched {len(edges)} broadcasts.")
+        log.debug("Fetched %d broadcasts.", len(edges))
 
+    new_broadcasts = []
     for edge in edges:
         node = edge.get('node', {})
         broadcast = node.get('broadcast', {})
@@ -557,11 +1016,435 @@ while True:
 
         b_id = broadcast.get("id", "")
         if b_id and b_id not in seen_broadcast_ids:
-            b_buy_token_id = broadcast.get("buyTokenId", "")
-            buy_token_data = fetch_token_data(b_buy_token_id) or {}
-            process_broadcast(broadcast, buy_token_data)
+            new_count += 1
+            new_broadcasts.append(broadcast)
         else:
             if b_id:
-                print(f"Broadcast {b_id} already processed.")
+                log.debug("Broadcast %s already processed.", b_id)
+                broadcasts_seen.inc(result="duplicate")
+    new_broadcasts.extend(take_retries({broadcast["id"] for broadcast in new_broadcasts}))
+
+    # A failed lookup only costs its own broadcasts: the rest of the poll is stored
+    # and the failed ones are retried from failed_broadcasts.
+    new_items = []
+    if ENRICH_BATCH:
+        for i in range(0, len(new_broadcasts), ENRICH_BATCH_MAX):
+            chunk = new_broadcasts[i:i + ENRICH_BATCH_MAX]
+            try:
+                new_items.extend(enrich_chunk(chunk))
+            except Exception as e:
+                log.warning("Enrichment failed for %d broadcasts: %s", len(chunk), e)
+                retry_later(chunk)
+    else:
+        for broadcast in new_broadcasts:
+            b_profile = broadcast.get("profile") or {}
+            try:
+                user_data = lookup_profile(b_profile.get("username", "")) or {}
+                buy_token_data = fetch_token_data(broadcast.get("buyTokenId", "")) or {}
+            except Exception as e:
+                log.warning("Enrichment failed for broadcast %s: %s", broadcast.get("id", ""), e)
+                retry_later([broadcast])
+                continue
+            new_items.append((broadcast, user_data, buy_token_data))
+    process_broadcasts(new_items)
+    return new_count
+
+
+def run_sync():
+    poll_interval = POLL_MIN_INTERVAL if DELTA_POLLING else 1
+    while True:
+        # Continuously fetch broadcasts every second, or adaptively in delta mode
+        new_count = 0
+        try:
+            new_count = poll_sync()
+        except Exception as e:
+            # Broadcasts are only marked seen once their rows are built, so the next poll retries them.
+            log.warning("Poll failed: %s", e)
+
+        report_stats()
+
+        if DELTA_POLLING:
+            poll_interval = next_poll_interval(poll_interval, new_count)
+        time.sleep(poll_interval)
+
+
+async def enrich_broadcast(semaphore, queue, in_flight, broadcast):
+    b_profile = broadcast.get("profile") or {}
+    try:
+        async with semaphore:
+            user_data, buy_token_data = await asyncio.gather(
+                asyncio.to_thread(lookup_profile, b_profile.get("username", "")),
+                asyncio.to_thread(fetch_token_data, broadcast.get("buyTokenId", "")),
+            )
+    except Exception as e:
+        # The next poll may stop at a newer broadcast above this one, so retry it from failed_broadcasts.
+        log.warning("Enrichment failed for broadcast %s: %s", broadcast.get('id', ''), e)
+        in_flight.discard(broadcast.get("id", ""))
+        retry_later([broadcast])
+        return
+    await queue.put((broadcast, user_data or {}, buy_token_data or {}))
+
+
+async def enrich_page_async(semaphore, queue, in_flight, broadcasts):
+    try:
+        async with semaphore:
+            items = await asyncio.to_thread(enrich_page, broadcasts)
+    except Exception as e:
+        # The next poll may stop at newer broadcasts above these, so retry them from failed_broadcasts.
+        log.warning("Enrichment failed for %d broadcasts: %s", len(broadcasts), e)
+        for broadcast in broadcasts:
+            in_flight.discard(broadcast.get("id", ""))
+        retry_later(broadcasts)
+        return
+    for item in items:
+        await queue.put(item)
+
+
+async def row_writer(queue, in_flight):
+    # The only place rows are built and stored in async mode, so the store and
+    # broadcast_data_dict never see concurrent writers from the event loop.
+    while True:
+        # Take everything that finished enrichment since the last pass as one batch.
+        items = [await queue.get()]
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        try:
+            process_broadcasts(items)
+        finally:
+            for broadcast, _, _ in items:
+                in_flight.discard(broadcast.get("id", ""))
+                queue.task_done()
+
+
+async def run_async():
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ENRICH_CONCURRENCY * 2 + 2, thread_name_prefix="enrich"))
+    semaphore = asyncio.Semaphore(ENRICH_CONCURRENCY)
+    queue = asyncio.Queue()
+    in_flight = set()
+    tasks = set()
+    writer = asyncio.create_task(row_writer(queue, in_flight))
+    poll_interval = POLL_MIN_INTERVAL if DELTA_POLLING else 1
+    while True:
+        try:
+            edges = await asyncio.to_thread(poll_edges, lambda b_id: b_id in seen_broadcast_ids or b_id in in_flight)
+        except Exception as e:
+            log.warning("Poll failed: %s", e)
+            edges = []
+
+        new_broadcasts = []
+        for edge in edges:
+            broadcast = (edge.get('node') or {}).get('broadcast') or {}
+            b_id = broadcast.get("id", "")
+            if b_id and b_id not in seen_broadcast_ids and b_id not in in_flight:
+                in_flight.add(b_id)
+                new_broadcasts.append(broadcast)
+            elif b_id:
+                broadcasts_seen.inc(result="duplicate")
+        for broadcast in take_retries(in_flight):
+            in_flight.add(broadcast["id"])
+            new_broadcasts.append(broadcast)
+        log.debug("Fetched %d broadcasts, %d new.", len(edges), len(new_broadcasts))
+
+        if ENRICH_BATCH and new_broadcasts:
+            pending = [enrich_page_async(semaphore, queue, in_flight, new_broadcasts)]
+        else:
+            pending = [enrich_broadcast(semaphore, queue, in_flight, broadcast) for broadcast in new_broadcasts]
+        for coro in pending:
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        enrich_queue_depth.set(queue.qsize())
+        enrich_in_flight.set(len(in_flight))
+        if writer.done():
+            writer.result()
+        report_stats()
+
+        if DELTA_POLLING:
+            poll_interval = next_poll_interval(poll_interval, len(new_broadcasts))
+        await asyncio.sleep(poll_interval)
+
+
+def run_shard_worker(index, shard, row_queue):
+    # Runs in a forked child. It gets its own HTTP pool and store connection and
+    # polls only its shard; its copy of the seen ids keeps it from re-enriching what
+    # it already handed over, while the parent does the cross-shard dedup and writes.
+    global client, feed_shard
+    # The parent's log writer thread does not exist in this process.
+    logs.configure(LOG_LEVEL, LOG_FORMAT)
+    feed_shard = shard
+    client = make_client()
+    if hasattr(store, "reopen"):
+        store.reopen()
+    poll_interval = POLL_MIN_INTERVAL if DELTA_POLLING else 1
+    try:
+        while True:
+            new_count = 0
+            try:
+                edges = poll_edges(lambda b_id: b_id in seen_broadcast_ids)
+                broadcasts = []
+                for edge in edges:
+                    broadcast = (edge.get('node') or {}).get('broadcast') or {}
+                    if broadcast.get("id") and broadcast["id"] not in seen_broadcast_ids:
+                        broadcasts.append(broadcast)
+                new_count = len(broadcasts)
+                if ENRICH_BATCH:
+                    items = enrich_page(broadcasts)
+                else:
+                    items = [(b, None, fetch_token_data(b.get("buyTokenId", "")) or {}) for b in broadcasts]
+                rows = build_new_rows(items, dict)
+                if rows:
+                    row_queue.put((index, rows))
+            except Exception as e:
+                log.warning("Shard %d poll failed: %s", index, e)
+            if DELTA_POLLING:
+                poll_interval = next_poll_interval(poll_interval, new_count)
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
 
-    time.sleep(1)  # Check every second
+
+def start_shard_workers():
+    # fork, not spawn: this script does all its work at import time. Must run before the
+    # scheduler, sampler and other threads start, so children never inherit a held lock;
+    # the log writer thread already runs, so it is stopped while the workers are forked.
+    context = multiprocessing.get_context("fork")
+    row_queue = context.Queue(maxsize=ROW_QUEUE_SIZE)
+    workers = []
+    with logs.paused(log_listener):
+        for index, overrides in enumerate(FEED_SHARDS):
+            shard = make_shard(overrides)
+            worker = context.Process(target=run_shard_worker, args=(index, shard, row_queue),
+                                     name=f"shard-{index}", daemon=True)
+            worker.start()
+            log.info("Started shard %d worker (pid %d): %s/%s %s", index, worker.pid, shard['mode'],
+                     shard['sortOrder'], shard['filters'])
+            workers.append(worker)
+    return workers, row_queue
+
+
+def run_supervisor(workers, row_queue):
+    shard_rows = registry.counter("shard_rows_total", "Rows received from each shard worker.", ["shard"])
+    registry.gauge("shard_workers_alive", "Shard worker processes still running.",
+                   callback=lambda: sum(worker.is_alive() for worker in workers))
+    reported_dead = set()
+    try:
+        while True:
+            batches = []
+            try:
+                batches.append(row_queue.get(timeout=1))
+                while True:
+                    batches.append(row_queue.get_nowait())
+            except Empty:
+                pass
+            rows = []
+            for index, shard_batch in batches:
+                shard_rows.inc(len(shard_batch), shard=index)
+                rows.extend(shard_batch)
+            if rows:
+                log.debug("Merging %d rows from %d shard batches.", len(rows), len(batches))
+                merge_rows(rows)
+
+            report_stats()
+
+            for worker in workers:
+                if not worker.is_alive() and worker.pid not in reported_dead:
+                    reported_dead.add(worker.pid)
+                    log.warning("Shard worker %s exited with code %s.", worker.name, worker.exitcode)
+            if len(reported_dead) == len(workers):
+                log.info("All shard workers have exited.")
+                return
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join(5)
+
+
+def load_backfill_progress():
+    if not os.path.exists(backfill_checkpoint_file):
+        return {}
+    with open(backfill_checkpoint_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_backfill_progress(progress):
+    tmp_path = backfill_checkpoint_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, backfill_checkpoint_file)
+
+
+# Market fields (and the flags derived from them) would be today's values on a backfilled
+# row, so backfill does not fetch them and leaves them empty; the marker column says why.
+market_keys = set(TOKEN_MARKET_FIELDS.split())
+market_columns = [column.name for column in SCHEMA
+                  if column.source and column.source[0] == "token" and column.source[-1] in market_keys]
+market_columns += [column.name for column in SCHEMA if set(column.inputs) & set(market_columns)]
+backfill_overrides = dict.fromkeys(market_columns)
+backfill_overrides["backfilled"] = True
+
+
+def backfill_stream(index, shard, state, pool, out, stop):
+    # Walks one shard's feed towards older broadcasts. Each page goes to the writer
+    # together with the cursor after it, so the checkpoint never moves past rows
+    # that are not stored yet. A failed page is retried from the same cursor.
+    page_cursor = state["cursor"]
+    pages = state["pages"]
+    walked = 0
+    while not stop.is_set():
+        if BACKFILL_MAX_PAGES and walked >= BACKFILL_MAX_PAGES:
+            return
+        try:
+            with stage_latency.time(stage="feed_poll"):
+                page = fetch_broadcasts(page_cursor, BACKFILL_PAGE_SIZE, shard)
+            broadcasts = [(edge.get('node') or {}).get('broadcast') or {} for edge in page.get('edges') or []]
+            broadcasts = [broadcast for broadcast in broadcasts if broadcast.get("id")]
+            reached_since = False
+            if BACKFILL_SINCE_MS:
+                kept = [broadcast for broadcast in broadcasts if int(broadcast.get("createdAt") or 0) >= BACKFILL_SINCE_MS]
+                reached_since = len(kept) < len(broadcasts)
+                broadcasts = kept
+            # Stored broadcasts are not enriched again; repeats across shards are dropped by the writer.
+            items = enrich_page([broadcast for broadcast in broadcasts if broadcast["id"] not in seen_broadcast_ids], pool,
+                                market=False)
+            rows = build_rows([{"broadcast": broadcast, "profile": profile, "token": token_data}
+                               for broadcast, profile, token_data in items], dict)
+            for row in rows:
+                row.update(backfill_overrides)
+        except Exception as e:
+            log.warning("Backfill shard %d page failed, retrying in %.0fs: %s", index, BACKFILL_RETRY_DELAY, e)
+            stop.wait(BACKFILL_RETRY_DELAY)
+            continue
+        page_info = page.get('pageInfo') or {}
+        next_cursor = page_info.get('endCursor')
+        pages += 1
+        walked += 1
+        done = reached_since or not page_info.get('hasNextPage') or not next_cursor
+        out.put((index, rows, next_cursor or page_cursor, pages, done))
+        if done:
+            return
+        page_cursor = next_cursor
+
+
+def run_backfill():
+    # Historical rows go straight to the store in bulk: no in-memory row, no variance
+    # checks (the horizons are long past). Don't run it against the store a live
+    # scraper is writing to; both would append to the same files.
+    backfill_rows = registry.counter("backfill_rows_total", "Rows written by backfill per shard.", ["shard"])
+    backfill_pages = registry.counter("backfill_pages_total", "Feed pages walked by backfill per shard.", ["shard"])
+    progress = load_backfill_progress()
+    out = Queue(maxsize=ROW_QUEUE_SIZE)
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=ENRICH_CONCURRENCY, thread_name_prefix="enrich")
+    streams = {}
+    for index, overrides in enumerate(FEED_SHARDS):
+        shard = make_shard(overrides)
+        key = json.dumps(shard, sort_keys=True)
+        state = progress.setdefault(key, {"cursor": None, "pages": 0, "rows": 0, "done": False})
+        if state["done"]:
+            log.info("Backfill of shard %d already finished (%d rows over %d pages).", index, state['rows'], state['pages'])
+            continue
+        thread = threading.Thread(target=backfill_stream, args=(index, shard, dict(state), pool, out, stop),
+                                  name=f"backfill-{index}", daemon=True)
+        streams[index] = (key, thread)
+        log.info("Backfilling shard %d from %s: %s/%s %s", index,
+                 'cursor ' + state['cursor'] if state['cursor'] else 'the newest page', shard['mode'], shard['sortOrder'],
+                 shard['filters'])
+        thread.start()
+
+    started = time.time()
+    written = 0
+    remaining = set(streams)
+    try:
+        while remaining:
+            batches = []
+            try:
+                batches.append(out.get(timeout=1))
+                while True:
+                    batches.append(out.get_nowait())
+            except Empty:
+                pass
+            new_rows = []
+            new_counts = []
+            for index, rows, _, _, _ in batches:
+                count = 0
+                for row_data in rows:
+                    b_id = row_data["broadcast_id"]
+                    if b_id in seen_broadcast_ids:
+                        broadcasts_seen.inc(result="duplicate")
+                        continue
+                    seen_broadcast_ids.add(b_id, recent=False)
+                    broadcasts_seen.inc(result="new")
+                    new_rows.append(row_data)
+                    count += 1
+                new_counts.append(count)
+            with stage_latency.time(stage="store_append"):
+                store.append_many(new_rows, pending=False)
+            written += len(new_rows)
+            for (index, _, cursor, pages, done), count in zip(batches, new_counts):
+                state = progress[streams[index][0]]
+                backfill_pages.inc(pages - state["pages"], shard=index)
+                backfill_rows.inc(count, shard=index)
+                state.update(cursor=cursor, pages=pages, rows=state["rows"] + count, done=done)
+                if done:
+                    remaining.discard(index)
+                    log.info("Backfill of shard %d finished: %d rows over %d pages.", index, state['rows'], pages)
+            if batches:
+                save_backfill_progress(progress)
+                elapsed = max(1e-9, time.time() - started)
+                log.debug("Backfilled %d rows from %d pages (%d total, %.1f rows/s).", len(new_rows), len(batches),
+                          written, written / elapsed)
+            for index in list(remaining):
+                if not streams[index][1].is_alive() and out.empty():
+                    state = progress[streams[index][0]]
+                    log.info("Backfill of shard %d stopped after page %d; run again to continue.", index, state['pages'])
+                    remaining.discard(index)
+
+            report_stats()
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+    log.info("Backfill complete: %d rows in %.1fs; progress kept in %s.", written, time.time() - started,
+             backfill_checkpoint_file)
+
+
+scheduler = TimerScheduler(run_variance_checks, workers=VARIANCE_WORKERS, batch_window=PRICE_BATCH_WINDOW)
+if SCRAPER_MODE == "supervisor":
+    shard_workers, shard_row_queue = start_shard_workers()
+scheduler.start()
+price_sampler = None
+if PRICE_SAMPLE_INTERVAL > 0:
+    price_sampler = PriceSampler(fetch_token_prices, interval=PRICE_SAMPLE_INTERVAL,
+                                 retention=LONGEST_HORIZON + 60, batch_max=PRICE_BATCH_MAX)
+    price_sampler.start()
+    registry.gauge("sampled_tokens", "Tokens whose price is being sampled.",
+                   callback=lambda: price_sampler.stats()["active"])
+horizon_journal = HorizonJournal(horizon_journal_file)
+resume_pending_checks()
+atexit.register(horizon_journal.close)
+
+threading.Thread(target=run_compactor, name="compactor", daemon=True).start()
+threading.Thread(target=run_checkpoints, name="checkpoints", daemon=True).start()
+if LOG_SUMMARY_INTERVAL > 0:
+    threading.Thread(target=run_log_summary, name="log-summary", daemon=True).start()
+
+if METRICS_PORT:
+    try:
+        serve_metrics(registry, METRICS_PORT, METRICS_HOST)
+        log.info("Serving metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        log.warning("Could not start metrics endpoint on port %d: %s", METRICS_PORT, e)
+
+if SCRAPER_MODE == "async":
+    log.info("Running asyncio pipeline with enrichment concurrency %d.", ENRICH_CONCURRENCY)
+    asyncio.run(run_async())
+elif SCRAPER_MODE == "supervisor":
+    log.info("Running %d shard workers with a single merge writer.", len(shard_workers))
+    run_supervisor(shard_workers, shard_row_queue)
+elif SCRAPER_MODE == "backfill":
+    log.info("Backfilling %d feed shards, %d broadcasts per page.", len(FEED_SHARDS), BACKFILL_PAGE_SIZE)
+    run_backfill()
+else:
+    run_sync()
@@ -0,0 +1,253 @@
+"""End-to-end throughput benchmark: runs apib.py against the local stand-in server.
+
+Starts ``standin_server`` in-process on a free port, launches the scraper as
+a subprocess pointed at it (temporary OUTPUT_FILE / SQLITE_PATH, dummy bearer
+token) and watches the output for new rows. Reports broadcasts/sec,
+broadcast-to-row latency (emitted by the stand-in until the row shows up on
+disk, so it includes the scraper's poll interval), requests per broadcast,
+CPU seconds and peak RSS of the scraper process.
+
+    python benchmark.py --duration 60 --rate 5 --latency-ms 40 --env SCRAPER_MODE=async
+
+Extra ``--env KEY=VALUE`` pairs are passed through to the scraper, so any of
+its knobs can be compared against the same baseline.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import standin_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def _descendants(pid):
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                for child in f.read().split():
+                    pids.extend(_descendants(int(child)))
+        except OSError:
+            pass
+    return pids
+
+
+def process_usage(pid):
+    """Return (cpu seconds, peak RSS bytes) for pid and its child processes (e.g. shard workers) from /proc,
+    or (None, None) where unavailable."""
+    cpu = rss = None
+    try:
+        pids = _descendants(pid)
+    except OSError:
+        return cpu, rss
+    for proc_pid in pids:
+        try:
+            with open(f"/proc/{proc_pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (cpu or 0) + (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            with open(f"/proc/{proc_pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        rss = (rss or 0) + int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+    return cpu, rss
+
+
+class CsvWatcher:
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.header = None
+        self.buffer = b""
+
+    def new_ids(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            # Compaction rewrote the file; re-read it, the caller ignores ids it has already seen.
+            self.offset, self.header, self.buffer = 0, None, b""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            chunk = f.read()
+        self.offset += len(chunk)
+        data = self.buffer + chunk
+        complete, _, self.buffer = data.rpartition(b"\n")
+        if not complete:
+            self.buffer = data
+            return []
+        rows = list(csv.reader(io.StringIO(complete.decode("utf-8") + "\n")))
+        if self.header is None and rows:
+            self.header = rows.pop(0)
+        index = self.header.index("broadcast_id")
+        return [row[index] for row in rows if len(row) > index]
+
+
+class SqliteWatcher:
+    def __init__(self, path):
+        self.path = path
+        self.rowid = 0
+
+    def new_ids(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=1)
+            try:
+                rows = conn.execute("SELECT rowid, broadcast_id FROM broadcasts WHERE rowid > ? ORDER BY rowid",
+                                    (self.rowid,)).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return []
+        if rows:
+            self.rowid = rows[-1][0]
+        return [b_id for _, b_id in rows]
+
+
+def run(args):
+    if args.fixtures:
+        with open(args.fixtures, "r", encoding="utf-8") as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = standin_server.fixtures_from_csv(args.csv)
+    port = args.port or free_port()
+    standin = standin_server.StandIn(fixtures, rate=args.rate, latency_ms=args.latency_ms,
+                                     jitter_ms=args.jitter_ms, seed=args.seed, max_in_flight=args.max_in_flight,
+                                     error_rate=args.error_rate)
+    server = standin_server.serve(standin, "127.0.0.1", port)
+
+    workdir = tempfile.mkdtemp(prefix="apib-bench-")
+    output_file = os.path.join(workdir, "enriched_broadcasts.csv")
+    env = dict(os.environ)
+    env.update({
+        "BEARER_TOKEN": env.get("BEARER_TOKEN") or "benchmark-token",
+        "GRAPHQL_ENDPOINT": f"http://127.0.0.1:{port}/graphql",
+        "OUTPUT_FILE": output_file,
+        "SQLITE_PATH": os.path.join(workdir, "enriched_broadcasts.db"),
+        "TOKEN_CACHE_FILE": os.path.join(workdir, "token_static_cache.json"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    for pair in args.env:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    watcher = SqliteWatcher(env["SQLITE_PATH"]) if env.get("STORAGE_BACKEND") == "sqlite" else CsvWatcher(output_file)
+
+    log = open(os.path.join(workdir, "apib.log"), "wb")
+    started = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "apib.py")], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    seen_at = {}
+    cpu = rss = None
+    try:
+        deadline = started + args.warmup + args.duration
+        while time.time() < deadline and proc.poll() is None:
+            time.sleep(args.poll_interval)
+            now = time.time()
+            for b_id in watcher.new_ids():
+                seen_at.setdefault(b_id, now)
+            cpu, rss = process_usage(proc.pid) if proc.poll() is None else (cpu, rss)
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        log.close()
+        server.shutdown()
+        standin.stop()
+
+    stats = standin.stats()
+    measure_from = started + args.warmup
+    emitted = {b_id: created_at / 1000.0 for b_id, created_at in stats["emitted"]}
+    latencies = [seen_at[b_id] - created for b_id, created in emitted.items()
+                 if created >= measure_from and b_id in seen_at]
+    measured = len(latencies)
+    elapsed = max(1e-9, min(time.time(), started + args.warmup + args.duration) - measure_from)
+    total_rows = len([b_id for b_id in seen_at if b_id in emitted])
+    result = {
+        "duration_s": round(elapsed, 2),
+        "emitted": len([c for c in emitted.values() if c >= measure_from]),
+        "rows": measured,
+        "broadcasts_per_s": round(measured / elapsed, 3),
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "requests": stats["requests"],
+        "requests_per_broadcast": round(stats["requests"] / total_rows, 2) if total_rows else None,
+        "requests_by_operation": stats["by_operation"],
+        "request_bytes_per_broadcast": round(stats["request_bytes"] / total_rows) if total_rows else None,
+        "throttled": stats["throttled"],
+        "failed": stats["failed"],
+        "cpu_s": cpu,
+        "peak_rss_mb": round(rss / 1048576, 1) if rss else None,
+        "exit_code": proc.returncode,
+        "workdir": workdir,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds, after --warmup")
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=2.0, help="new broadcasts per second")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="how often the output is checked")
+    parser.add_argument("--fixtures", help="fixture JSON for the stand-in; defaults to one rebuilt from --csv")
+    parser.add_argument("--csv", default=os.path.join(HERE, "enriched_broadcasts.csv"))
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-in-flight", type=int, default=0, help="stand-in answers 429 beyond this many")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stand-in requests failed with 503")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra scraper env")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    p50, p99 = result["latency_p50_s"], result["latency_p99_s"]
+    print(f"Broadcasts: {result['rows']}/{result['emitted']} in {result['duration_s']}s "
+          f"({result['broadcasts_per_s']}/s)")
+    if p50 is not None:
+        print(f"Broadcast-to-row latency: p50 {p50:.3f}s, p99 {p99:.3f}s")
+    print(f"Requests: {result['requests']} ({result['requests_per_broadcast']} per broadcast) "
+          f"{result['requests_by_operation']}, {result['request_bytes_per_broadcast']} bytes uploaded per broadcast, "
+          f"{result['throttled']} throttled, {result['failed']} failed")
+    print(f"Scraper CPU: {result['cpu_s']}s, peak RSS: {result['peak_rss_mb']} MB, exit code {result['exit_code']}")
+    print(f"Output and log in {result['workdir']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Size-bounded TTL cache with stale-while-revalidate."""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Caches ``loader(key)`` results for ``ttl`` seconds, evicting least recently used.
+
+    An expired entry is still returned immediately while a background
+    refresh replaces it, so only the very first lookup of a key waits on
+    the loader. A loader that returns None found nothing worth keeping:
+    the key stays a miss, and a stale entry keeps its old value.
+    """
+
+    def __init__(self, loader, ttl=300, maxsize=1024, refresh_workers=2, name="cache"):
+        self.loader = loader
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.name = name
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix=f"{name}-refresh")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self._dirty = False
+
+    def get(self, key):
+        found, value = self.lookup(key)
+        if found:
+            return value
+        value = self.loader(key)
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def lookup(self, key):
+        """Return (True, value) if key is cached, else (False, None) without calling the loader.
+
+        Lets callers batch the misses of several keys into one request and
+        ``put`` the results; stale entries are refreshed as in ``get``.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            value, expires_at = entry
+            if now < expires_at:
+                self.hits += 1
+                return True, value
+            self.stale_hits += 1
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                self._pool.submit(self._refresh, key)
+            return True, value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            self._dirty = True
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, key):
+        try:
+            value = self.loader(key)
+            if value is not None:
+                self.put(key, value)
+            with self._lock:
+                self.refreshes += 1
+        except Exception:
+            log.exception("Refreshing %s cache entry %s failed", self.name, key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def dump(self, path):
+        """Write a JSON snapshot of the cache; a no-op if nothing changed since the last one."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            snapshot = [[key, value, expires_at] for key, (value, expires_at) in self._entries.items()]
+            self._dirty = False
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+        return True
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except ValueError:
+            log.warning("Ignoring unreadable %s cache snapshot at %s.", self.name, path)
+            return 0
+        with self._lock:
+            for key, value, expires_at in snapshot[-self.maxsize:]:
+                # Empty entries are nulls cached by older versions; load them as misses.
+                if value not in (None, {}):
+                    self._entries[key] = (value, expires_at)
+        return len(snapshot)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,46 @@
+"""Build one aliased GraphQL document out of many root field lookups.
+
+Each lookup gets its own alias and its own variables, so a whole page of
+profile and token queries goes out as a single POST and every result can be
+picked back out of the response by alias:
+
+    doc = Document("PageEnrichmentQuery")
+    doc.variable("yourProfileId", "String!", YOUR_PROFILE_ID)
+    doc.field("p0", "profile", PROFILE_FIELDS, username=("String!", "alice"))
+    data = client.execute(doc.render(), doc.variables)
+    data.get("p0")
+"""
+
+
+class Document:
+    def __init__(self, name):
+        self.name = name
+        self.variables = {}
+        self._types = {}
+        self._fields = []
+
+    def variable(self, name, type_, value):
+        """Declare ``$name`` for use inside selection sets; returns the reference."""
+        if name in self._types and self.variables[name] != value:
+            raise ValueError(f"variable ${name} is already bound to a different value")
+        self._types[name] = type_
+        self.variables[name] = value
+        return f"${name}"
+
+    def field(self, alias, name, selection=None, **args):
+        """Add ``alias: name(arg: $alias_arg ...) { selection }``; args map to (GraphQL type, value)."""
+        refs = []
+        for arg, (type_, value) in args.items():
+            refs.append(f"{arg}: {self.variable(f'{alias}_{arg}', type_, value)}")
+        call = f"({', '.join(refs)})" if refs else ""
+        body = f" {{{selection}}}" if selection else ""
+        self._fields.append(f"  {alias}: {name}{call}{body}")
+        return alias
+
+    def __len__(self):
+        return len(self._fields)
+
+    def render(self):
+        var_defs = ", ".join(f"${name}: {type_}" for name, type_ in self._types.items())
+        header = f"query {self.name}({var_defs})" if var_defs else f"query {self.name}"
+        return header + " {\n" + "\n".join(self._fields) + "\n}"
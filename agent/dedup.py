@@ -0,0 +1,136 @@
+"""Bounded-memory set of broadcast ids that have already been processed.
+
+Recently added ids are kept exactly in a time-windowed ordered dict; once
+they age out they only live on in a Bloom filter. A Bloom hit can be
+confirmed against the store (e.g. an SQLite primary-key lookup) so a false
+positive never drops a genuinely new broadcast when such a lookup exists.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+SNAPSHOT_MAGIC = b"BCSTSEEN"
+# magic, bit count, hash count, ids added, store marker generation, store marker position
+SNAPSHOT_HEADER = struct.Struct("<8sQIQQQ")
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        # Only count keys that set a new bit, so adding a key twice does not count it twice.
+        added = False
+        for pos in self._positions(key):
+            bit = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & bit:
+                self.bits[pos >> 3] |= bit
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SeenIds:
+    def __init__(self, window=3600, max_recent=100000, capacity=2000000, error_rate=1e-5, confirm=None):
+        self.window = window
+        self.max_recent = max_recent
+        self.confirm = confirm
+        self._recent = OrderedDict()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+
+    def add(self, b_id, recent=True):
+        with self._lock:
+            self._bloom.add(b_id)
+            if recent:
+                self._recent[b_id] = time.time()
+                self._recent.move_to_end(b_id)
+                self._expire()
+
+    def update(self, b_ids, recent=False):
+        for b_id in b_ids:
+            self.add(b_id, recent=recent)
+
+    def _expire(self):
+        cutoff = time.time() - self.window
+        while self._recent:
+            b_id, added_at = next(iter(self._recent.items()))
+            if added_at >= cutoff and len(self._recent) <= self.max_recent:
+                break
+            self._recent.popitem(last=False)
+
+    def __contains__(self, b_id):
+        with self._lock:
+            if b_id in self._recent:
+                return True
+            if b_id not in self._bloom:
+                return False
+        if self.confirm is None:
+            return True
+        if not self.confirm(b_id):
+            return False
+        # Keep a confirmed id exact for a while; polls ask about the same ids over and over.
+        with self._lock:
+            self._recent[b_id] = time.time()
+            self._recent.move_to_end(b_id)
+            self._expire()
+        return True
+
+    def __len__(self):
+        return self._bloom.count
+
+    def dump(self, path, marker):
+        """Snapshot the Bloom filter along with the store position it covers (see ``RowStore.index_position``)."""
+        with self._lock:
+            header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self._bloom.size, self._bloom.hashes,
+                                          self._bloom.count, marker[0], marker[1])
+            bits = bytes(self._bloom.bits)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(bits)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore a snapshot written by ``dump``; returns its store marker, or None if unusable."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) != SNAPSHOT_HEADER.size:
+                return None
+            magic, size, hashes, count, generation, position = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or size != self._bloom.size or hashes != self._bloom.hashes:
+                return None
+            bits = f.read()
+        if len(bits) != len(self._bloom.bits):
+            return None
+        with self._lock:
+            self._bloom.bits = bytearray(bits)
+            self._bloom.count = count
+        return generation, position
+
+    def stats(self):
+        with self._lock:
+            return {
+                "recent": len(self._recent),
+                "total": self._bloom.count,
+                "bloom_bytes": len(self._bloom.bits),
+            }
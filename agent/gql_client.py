@@ -0,0 +1,311 @@
+"""Shared GraphQL client holding one keep-alive connection pool."""
+
+import email.utils
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from limiter import ERROR, OK, THROTTLED
+from singleflight import SingleFlight
+
+OPERATION_RE = re.compile(r"^\s*(?:query|mutation)\s+([A-Za-z_][A-Za-z0-9_]*)")
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+# Worth another try after a backoff; any other error status is final.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class GraphQLError(Exception):
+    """A request that gave no usable data: an HTTP error that outlasted its retries, a body that is
+    not JSON, or a response whose data is null."""
+
+
+def operation_name(query):
+    match = OPERATION_RE.match(query)
+    return match.group(1) if match else "anonymous"
+
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def response_data(document, operation="anonymous"):
+    """The data of a decoded GraphQL response; raises GraphQLError when there is none."""
+    data = (document or {}).get("data")
+    if data is None:
+        messages = [(error or {}).get("message", "") for error in (document or {}).get("errors") or []]
+        raise GraphQLError(f"{operation}: {'; '.join(messages) if messages else 'response has no data'}")
+    return data
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+class PreparedQuery:
+    """A query compiled once into request-body templates; only the variables are encoded per call."""
+
+    def __init__(self, query):
+        # Collapsing whitespace is only safe without string literals in the document.
+        self.query = query if '"' in query else " ".join(query.split())
+        self.operation = operation_name(self.query)
+        self.sha256 = hashlib.sha256(self.query.encode("utf-8")).hexdigest()
+        self.full_prefix = self._prefix(query=True)
+        self._hash_prefix = None
+        # Set once the server has been sent the text with its hash; after that the hash alone is enough.
+        self.registered = False
+
+    def _prefix(self, query=False, extensions=False):
+        parts = [f'"operationName":{_dumps(self.operation)}']
+        if query:
+            parts.append(f'"query":{_dumps(self.query)}')
+        if extensions:
+            parts.append(f'"extensions":{_dumps({"persistedQuery": {"version": 1, "sha256Hash": self.sha256}})}')
+        return ("{" + ",".join(parts) + ',"variables":').encode("utf-8")
+
+    @property
+    def hash_prefix(self):
+        # Automatic persisted queries: the hash alone once registered, hash plus text otherwise.
+        if self._hash_prefix is None:
+            self._hash_prefix = self._prefix(extensions=True)
+        return self._hash_prefix
+
+    @property
+    def register_prefix(self):
+        return self._prefix(query=True, extensions=True)
+
+    def body(self, variables, prefix=None):
+        return (prefix or self.full_prefix) + _dumps(variables or {}).encode("utf-8") + b"}"
+
+
+class GraphQLClient:
+    def __init__(self, endpoint, headers, pool_size=16, timeout=30, verify=False, latency=None, errors=None,
+                 persisted_queries=False, prepared_cache_size=64, limiter=None, max_retries=4, retry_base=0.5,
+                 retry_max=30.0, retries=None, single_flight=True, coalesced=None):
+        # latency / errors / coalesced: optional metrics.Histogram / metrics.Counter labelled by operation;
+        # retries: optional metrics.Counter labelled by operation and reason.
+        # persisted_queries sends a sha256 hash in place of the document text (Apollo APQ protocol).
+        # limiter: optional limiter.AdaptiveLimiter bounding requests in flight.
+        # single_flight: concurrent execute() calls with the same document and variables share one request.
+        self.endpoint = endpoint
+        self.latency = latency
+        self.errors = errors
+        self.retries = retries
+        self.coalesced = coalesced
+        self.flights = SingleFlight() if single_flight else None
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.persisted_queries = persisted_queries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.headers["Content-Type"] = "application/json"
+        self.session.headers["Connection"] = "keep-alive"
+        self.session.verify = verify
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        # Query strings are module constants, so the same text maps to the same template every call;
+        # generated documents with a repeating shape (e.g. N aliased price lookups) reuse theirs too.
+        self._prepared = OrderedDict()
+        self._prepared_cache_size = prepared_cache_size
+        self._lock = threading.Lock()
+        self.bytes_sent = 0
+        self.persisted_misses = 0
+
+    def prepare(self, query):
+        if isinstance(query, PreparedQuery):
+            return query
+        with self._lock:
+            prepared = self._prepared.get(query)
+            if prepared is not None:
+                self._prepared.move_to_end(query)
+                return prepared
+        prepared = PreparedQuery(query)
+        with self._lock:
+            self._prepared[query] = prepared
+            while len(self._prepared) > self._prepared_cache_size:
+                self._prepared.popitem(last=False)
+        return prepared
+
+    @contextmanager
+    def _slot(self):
+        if self.limiter is None:
+            yield [OK]
+            return
+        with self.limiter.slot() as outcome:
+            yield outcome
+
+    def _send(self, body, operation="anonymous", stream=False):
+        # 429, 5xx and dropped connections are retried up to max_retries times with full-jitter
+        # exponential backoff, and never sooner than a Retry-After; other statuses are returned
+        # as they are, since GraphQL servers put their errors in the body.
+        attempt = 0
+        while True:
+            with self._lock:
+                self.bytes_sent += len(body)
+            retry_after = None
+            with self._slot() as outcome:
+                try:
+                    response = self.session.post(self.endpoint, data=body, timeout=self.timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    outcome[0] = ERROR
+                    reason, failure = "connection", e
+                else:
+                    if response.status_code not in RETRY_STATUSES:
+                        return response
+                    outcome[0] = THROTTLED if response.status_code == 429 else ERROR
+                    reason, failure = str(response.status_code), f"HTTP {response.status_code}"
+                    retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                    response.close()
+            if retry_after is not None and self.limiter is not None:
+                self.limiter.pause(retry_after)
+            if attempt >= self.max_retries:
+                raise GraphQLError(f"{operation}: {failure} after {attempt + 1} attempts")
+            if self.retries is not None:
+                self.retries.inc(operation=operation, reason=reason)
+            time.sleep(max(retry_after or 0.0, random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))))
+            attempt += 1
+
+    def _post(self, body, operation="anonymous"):
+        response = self._send(body, operation)
+        try:
+            return response.json() or {}
+        except ValueError:
+            raise GraphQLError(f"{operation}: HTTP {response.status_code} with a body that is not JSON") from None
+
+    def execute(self, query, variables=None):
+        prepared = self.prepare(query)
+        if self.flights is None:
+            return self._execute(prepared, variables)
+        # Followers get the leader's parsed result object itself; treat it as read-only.
+        key = (prepared.sha256, json.dumps(variables or {}, sort_keys=True, separators=(",", ":")))
+        call, leader = self.flights.begin(key)
+        if not leader:
+            if self.coalesced is not None:
+                self.coalesced.inc(operation=prepared.operation)
+            return call.wait()
+        try:
+            result = self._execute(prepared, variables)
+        except BaseException as e:
+            self.flights.fail(key, e)
+            raise
+        self.flights.finish(key, result)
+        return result
+
+    def _execute(self, prepared, variables):
+        started = time.perf_counter()
+        try:
+            operation = prepared.operation
+            if self.persisted_queries and prepared.registered:
+                data = self._post(prepared.body(variables, prepared.hash_prefix), operation)
+                if any((error or {}).get("message") == PERSISTED_QUERY_NOT_FOUND for error in data.get("errors") or []):
+                    # The server dropped it (restart, eviction); send the text again.
+                    with self._lock:
+                        self.persisted_misses += 1
+                    data = self._post(prepared.body(variables, prepared.register_prefix), operation)
+            elif self.persisted_queries:
+                data = self._post(prepared.body(variables, prepared.register_prefix), operation)
+                prepared.registered = "errors" not in data
+            else:
+                data = self._post(prepared.body(variables), operation)
+            result = response_data(data, operation)
+        except Exception:
+            if self.errors is not None:
+                self.errors.inc(operation=prepared.operation)
+            raise
+        finally:
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started, operation=prepared.operation)
+        return result
+
+    @contextmanager
+    def stream(self, query, variables=None, chunk_size=8192, drain_limit=65536):
+        """POST like ``execute``, but yield an iterator over the raw response body as it arrives.
+
+        Whatever the caller leaves unread is drained afterwards if it is at most
+        ``drain_limit`` bytes, so the keep-alive connection goes back to the pool;
+        a larger remainder closes the connection instead of downloading it.
+        """
+        prepared = self.prepare(query)
+        started = time.perf_counter()
+        response = None
+        try:
+            if self.persisted_queries and prepared.registered:
+                response = self._send(prepared.body(variables, prepared.hash_prefix), prepared.operation, stream=True)
+                chunks = response.iter_content(chunk_size)
+                first = next(chunks, b"")
+                if PERSISTED_QUERY_NOT_FOUND.encode("utf-8") in first and not first.startswith(b'{"data"'):
+                    with self._lock:
+                        self.persisted_misses += 1
+                    response.close()
+                    response = self._send(prepared.body(variables, prepared.register_prefix), prepared.operation,
+                                          stream=True)
+                    chunks = response.iter_content(chunk_size)
+                else:
+                    chunks = itertools.chain([first], chunks)
+            else:
+                prefix = prepared.register_prefix if self.persisted_queries else None
+                response = self._send(prepared.body(variables, prefix), prepared.operation, stream=True)
+                prepared.registered = self.persisted_queries and response.status_code == 200
+                chunks = response.iter_content(chunk_size)
+            yield chunks
+            drained = 0
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > drain_limit:
+                    break
+        except Exception:
+            if self.errors is not None:
+                self.errors.inc(operation=prepared.operation)
+            raise
+        finally:
+            if response is not None:
+                response.close()
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started, operation=prepared.operation)
+
+    def connection_stats(self):
+        """Connections opened vs requests sent across the pool; reuse_rate near 1 means keep-alive works."""
+        connections = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            "connections": connections,
+            "requests": requests_sent,
+            "bytes_sent": self.bytes_sent,
+            "persisted_misses": self.persisted_misses,
+            "coalesced": self.flights.stats()["shared"] if self.flights is not None else 0,
+            "limit": self.limiter.stats()["limit"] if self.limiter is not None else None,
+            "reuse_rate": 1 - connections / requests_sent if requests_sent else 0.0,
+        }
+
+    def close(self):
+        self.session.close()
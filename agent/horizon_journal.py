@@ -0,0 +1,135 @@
+"""Append-only journal of scheduled variance checks, so restarts can resume them.
+
+Every check handed to the scheduler is written as an ``add`` line with its
+broadcast id, token id, broadcast price, columns and due time; a ``done`` or
+``expired`` line retires it. ``load()`` replays the file and returns the
+checks that never finished. Once retired lines outnumber live ones the file
+is rewritten with just the live checks. Retiring checks reports the
+broadcasts left with none, so their rows can be let go.
+"""
+
+import json
+import os
+import threading
+
+
+class HorizonJournal:
+    def __init__(self, path, compact_min=1000):
+        self.path = path
+        self.compact_min = compact_min
+        self._live = {}
+        self._live_per_id = {}
+        self._retired = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    @staticmethod
+    def _key(check):
+        # checks are scheduler payloads: (b_id, token_id, price_bcast, variance column, won column, due)
+        return check[0], check[3]
+
+    @staticmethod
+    def _add_line(check):
+        b_id, token_id, price, var, won, due = check
+        return json.dumps({"op": "add", "id": b_id, "token": token_id, "price": price, "var": var, "won": won,
+                           "due": due})
+
+    def load(self):
+        """Replay the journal and open it for appending; returns the pending checks sorted by due time."""
+        live = {}
+        retired = 0
+        needs_newline = False
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write; everything before it is intact.
+                        continue
+                    key = (record["id"], record["var"])
+                    if record["op"] == "add":
+                        live[key] = (record["id"], record["token"], record["price"], record["var"], record["won"],
+                                     record["due"])
+                    elif live.pop(key, None) is not None:
+                        retired += 2
+        live_per_id = {}
+        for b_id, _ in live:
+            live_per_id[b_id] = live_per_id.get(b_id, 0) + 1
+        with self._lock:
+            self._live = live
+            self._live_per_id = live_per_id
+            self._retired = retired
+            self._file = open(self.path, "a", encoding="utf-8")
+            if needs_newline:
+                self._file.write("\n")
+        return sorted(live.values(), key=lambda check: check[5])
+
+    def add(self, checks):
+        lines = [self._add_line(check) for check in checks]
+        with self._lock:
+            for check in checks:
+                key = self._key(check)
+                if key not in self._live:
+                    self._live_per_id[check[0]] = self._live_per_id.get(check[0], 0) + 1
+                self._live[key] = check
+            self._write(lines)
+
+    def done(self, checks):
+        """Retire checks that ran; returns the broadcast ids left with no live check."""
+        return self._retire(checks, "done")
+
+    def expire(self, checks):
+        """Retire checks that will never run; returns the broadcast ids left with no live check."""
+        return self._retire(checks, "expired")
+
+    def _retire(self, checks, op):
+        finished = []
+        with self._lock:
+            lines = []
+            for check in checks:
+                if self._live.pop(self._key(check), None) is None:
+                    continue
+                lines.append(json.dumps({"op": op, "id": check[0], "var": check[3]}))
+                self._retired += 2
+                remaining = self._live_per_id[check[0]] - 1
+                if remaining:
+                    self._live_per_id[check[0]] = remaining
+                else:
+                    del self._live_per_id[check[0]]
+                    finished.append(check[0])
+            self._write(lines)
+            if self._retired >= max(self.compact_min, 2 * len(self._live)):
+                self._compact()
+        return finished
+
+    def _write(self, lines):
+        if lines and self._file is not None:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+
+    def _compact(self):
+        if self._file is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for check in self._live.values():
+                f.write(self._add_line(check) + "\n")
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._retired = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._live)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
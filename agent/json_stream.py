@@ -0,0 +1,148 @@
+"""Incremental scanner that pulls one array out of a JSON response body.
+
+``iter_array_items`` consumes the body chunk by chunk and yields the raw
+bytes of each element of the first array stored under ``key`` as soon as the
+element's closing brace arrives, so a caller can look at (or skip) an edge
+before the rest of the page has even been read. Only the scanned element is
+ever buffered; ``json.loads`` is left to the caller, which can decide from
+the raw bytes whether the element is worth materializing.
+
+Objects are delimited by counting braces outside of strings, which is all
+that is needed for GraphQL responses: elements are objects, and keys appear
+in selection-set order.
+"""
+
+import json
+import re
+
+WHITESPACE = b" \t\r\n"
+_STRUCTURE = re.compile(rb'[{}"]')
+_STRING_END = re.compile(rb'["\\]')
+_SEEK_TAIL = 64
+
+
+class _ObjectScanner:
+    """Finds the end of one JSON object fed to it in pieces."""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, data, start):
+        # Returns the index just past the closing brace, or None if data ends first.
+        pos = start
+        while True:
+            if self.escaped:
+                if pos >= len(data):
+                    return None
+                self.escaped = False
+                pos += 1
+            if self.in_string:
+                match = _STRING_END.search(data, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                if match.group() == b"\\":
+                    self.escaped = True
+                else:
+                    self.in_string = False
+                continue
+            match = _STRUCTURE.search(data, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            char = match.group()
+            if char == b'"':
+                self.in_string = True
+            elif char == b"{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+
+def iter_array_items(chunks, key, tail_keys=()):
+    """Yield ("item", raw_bytes) per element of the array under ``key``, then (tail_key, value) for each
+    of ``tail_keys`` found after the array. If ``key`` never shows up (errors, null data) the whole body is
+    parsed instead and yielded once as ("document", value)."""
+    key_re = re.compile(rb'"' + re.escape(key.encode("utf-8")) + rb'"\s*:\s*\[')
+    tail_res = [(name, re.compile(rb'"' + re.escape(name.encode("utf-8")) + rb'"\s*:\s*')) for name in tail_keys]
+    head = []
+    buffer = b""
+    state = "seek"
+    scanner = None
+    scan_from = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if state == "seek":
+            head.append(chunk)
+        buffer += chunk
+        while True:
+            if state == "seek":
+                match = key_re.search(buffer)
+                if match is None:
+                    buffer = buffer[-_SEEK_TAIL:]
+                    break
+                buffer = buffer[match.end():]
+                head = None
+                state = "items"
+            if state == "items":
+                stripped = buffer.lstrip(WHITESPACE + b",")
+                if not stripped:
+                    buffer = b""
+                    break
+                if stripped[:1] == b"]":
+                    buffer = stripped[1:]
+                    state = "tail"
+                    continue
+                if scanner is None:
+                    buffer = stripped
+                    scanner = _ObjectScanner()
+                    scan_from = 0
+                end = scanner.feed(buffer, scan_from)
+                if end is None:
+                    scan_from = len(buffer)
+                    break
+                yield "item", buffer[:end]
+                buffer = buffer[end:]
+                scanner = None
+                continue
+            if state == "tail":
+                if not tail_res:
+                    return
+                found = None
+                for name, pattern in tail_res:
+                    match = pattern.search(buffer)
+                    if match is not None:
+                        found = (name, match)
+                        break
+                if found is None:
+                    buffer = buffer[-_SEEK_TAIL:]
+                    break
+                name, match = found
+                rest = buffer[match.end():].lstrip(WHITESPACE)
+                if not rest:
+                    break
+                if rest[:1] != b"{":
+                    # null (or a scalar); read up to the next delimiter.
+                    token = re.match(rb"[^,}\]\s]*", rest).group()
+                    if len(token) == len(rest):
+                        break
+                    yield name, json.loads(token)
+                    buffer = rest[len(token):]
+                else:
+                    value_scanner = _ObjectScanner()
+                    end = value_scanner.feed(rest, 0)
+                    if end is None:
+                        break
+                    yield name, json.loads(rest[:end])
+                    buffer = rest[end:]
+                tail_res = [(other, pattern) for other, pattern in tail_res if other != name]
+                continue
+            break
+    if state == "seek" and head is not None:
+        body = b"".join(head)
+        yield "document", json.loads(body) if body.strip() else {}
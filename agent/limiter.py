@@ -0,0 +1,85 @@
+"""Adaptive (AIMD) cap on concurrent requests to one endpoint.
+
+Every request holds a slot while it is in flight. Each healthy response --
+fast enough and not an error -- while the limit is actually in use raises the
+limit by 1/limit, so a full window of successes adds one slot. A throttled,
+failed or slow response cuts it by ``decrease`` at most once per
+``latency_target`` seconds, so a burst of 429s from one window counts once.
+A ``Retry-After`` holds back every new request until it has passed.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+OK = "ok"
+ERROR = "error"
+THROTTLED = "throttled"
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=8, minimum=1, maximum=64, latency_target=2.0, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.throttled = 0
+        self.decreases = 0
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+
+    def release(self, outcome, latency):
+        with self._cond:
+            in_use = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if outcome == THROTTLED:
+                self.throttled += 1
+            if outcome != OK or latency > self.latency_target:
+                now = time.time()
+                if now - self._last_decrease >= self.latency_target:
+                    self._last_decrease = now
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.decreases += 1
+            elif in_use:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Start no request for the next ``seconds`` (a server's Retry-After)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for one request; the caller sets ``outcome[0]`` to THROTTLED or ERROR when it fails."""
+        self.acquire()
+        outcome = [OK]
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome[0] = ERROR
+            raise
+        finally:
+            self.release(outcome[0], time.perf_counter() - started)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "decreases": self.decreases,
+            }
@@ -0,0 +1,84 @@
+"""Non-blocking logging for the scraper.
+
+``configure`` puts a queue handler on the root logger, so a logging call
+only enqueues the record; one listener thread formats it and writes it to
+stdout, as plain text or as JSON lines. Structured fields go in
+``extra={"fields": {...}}`` and become top-level keys of the JSON object
+(``key=value`` pairs after the message in text output).
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from contextlib import contextmanager
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return message
+        return message + " " + " ".join(f"{key}={value}" for key, value in fields.items())
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues the record untouched, so %-formatting happens on the listener thread rather than the caller's.
+
+    Safe because log arguments here are immutable values (ids, numbers, strings).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure(level="INFO", fmt="text", stream=None):
+    """Route all logging through a queue to one writer thread; returns the started QueueListener.
+
+    Call it again in a forked child: the parent's listener thread does not exist there.
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    listener.start()
+    # atexit is LIFO: configure before registering other exit hooks so their records still get written.
+    atexit.register(listener.stop)
+    return listener
+
+
+@contextmanager
+def paused(listener):
+    """Stop the writer thread for the duration, e.g. around a fork; records queued meanwhile are written after.
+
+    A child forked while the thread is writing inherits the stdout lock held, and its first log write hangs.
+    """
+    listener.stop()
+    try:
+        yield
+    finally:
+        listener.start()
@@ -0,0 +1,160 @@
+"""Continuous price sampling for the tokens that have broadcasts in flight.
+
+A token is active while any of its broadcasts is still inside its longest
+horizon. One background thread polls the prices of all active tokens at a
+fixed cadence with batched requests and appends each result to that token's
+ring buffer -- two preallocated ``array('d')`` columns of times and prices --
+so variance, peak and drawdown for any horizon come from stored samples
+instead of extra API calls.
+"""
+
+import logging
+import threading
+import time
+from array import array
+
+log = logging.getLogger(__name__)
+
+
+class PriceSeries:
+    __slots__ = ("times", "prices", "start", "count")
+
+    def __init__(self, capacity):
+        self.times = array("d", bytes(8 * capacity))
+        self.prices = array("d", bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def append(self, t, price):
+        capacity = len(self.times)
+        i = (self.start + self.count) % capacity
+        self.times[i] = t
+        self.prices[i] = price
+        if self.count < capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def _newest_first(self):
+        capacity = len(self.times)
+        for k in range(self.count - 1, -1, -1):
+            yield (self.start + k) % capacity
+
+    def at(self, t, tolerance):
+        """Price of the latest sample taken at or before t, if it is at most ``tolerance`` seconds old."""
+        for i in self._newest_first():
+            if self.times[i] <= t:
+                return self.prices[i] if t - self.times[i] <= tolerance else None
+        return None
+
+    def path(self, t0, t1, start_price):
+        """(peak price, max drawdown) over samples taken in [t0, t1], or None if there are none.
+
+        The drawdown is the largest fall from a running peak to a later price, as a
+        fraction (-0.25 is a 25% fall); the running peak starts at ``start_price``.
+        """
+        capacity = len(self.times)
+        peak = start_price
+        high = None
+        drawdown = 0.0
+        for k in range(self.count):
+            i = (self.start + k) % capacity
+            sample_time = self.times[i]
+            if sample_time < t0:
+                continue
+            if sample_time > t1:
+                break
+            price = self.prices[i]
+            if high is None or price > high:
+                high = price
+            if price > peak:
+                peak = price
+            elif peak > 0:
+                drawdown = min(drawdown, price / peak - 1.0)
+        return None if high is None else (high, drawdown)
+
+
+class PriceSampler:
+    def __init__(self, fetch_prices, interval=2.0, retention=360.0, keep_after=60.0, batch_max=50):
+        # fetch_prices(token_ids) -> {token_id: price or None}; retention bounds each ring buffer.
+        self.fetch_prices = fetch_prices
+        self.interval = interval
+        self.keep_after = keep_after
+        self.batch_max = batch_max
+        self.capacity = int(retention / interval) + 2
+        self._series = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="price-sampler", daemon=True)
+        self.rounds = 0
+        self.samples = 0
+
+    def track(self, token_id, until):
+        """Keep sampling token_id until the given time."""
+        if not token_id:
+            return
+        with self._lock:
+            if until > self._active.get(token_id, 0.0):
+                self._active[token_id] = until
+
+    def price_at(self, token_id, t, tolerance=None):
+        with self._lock:
+            series = self._series.get(token_id)
+            if series is None:
+                return None
+            return series.at(t, tolerance if tolerance is not None else 2 * self.interval)
+
+    def path(self, token_id, t0, t1, start_price):
+        with self._lock:
+            series = self._series.get(token_id)
+            return series.path(t0, t1, start_price) if series is not None else None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def sample_once(self):
+        now = time.time()
+        with self._lock:
+            for token_id, until in list(self._active.items()):
+                if now > until + self.keep_after:
+                    # Nothing can ask about this token any more.
+                    del self._active[token_id]
+                    self._series.pop(token_id, None)
+            tokens = [token_id for token_id, until in self._active.items() if now <= until]
+        for i in range(0, len(tokens), self.batch_max):
+            prices = self.fetch_prices(tokens[i:i + self.batch_max])
+            sampled_at = time.time()
+            with self._lock:
+                for token_id, price in prices.items():
+                    if price is None:
+                        continue
+                    series = self._series.get(token_id)
+                    if series is None:
+                        series = self._series[token_id] = PriceSeries(self.capacity)
+                    series.append(sampled_at, float(price))
+                    self.samples += 1
+        self.rounds += 1
+        return len(tokens)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            started = time.time()
+            try:
+                self.sample_once()
+            except Exception:
+                log.exception("Price sampling round failed")
+            self._stopped.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": sum(1 for until in self._active.values() if until >= time.time()),
+                "series": len(self._series),
+                "rounds": self.rounds,
+                "samples": self.samples,
+            }
@@ -0,0 +1,555 @@
+"""Append-only storage for enriched broadcast rows.
+
+New rows are appended straight to the CSV and variance/won updates are
+appended to a small JSON-lines patch log next to it, so the cost of a write
+does not depend on how many rows the file already holds. ``compact()`` folds
+the patch log back into the CSV once the log has grown past a share of the
+CSV or on a schedule, from a background thread in the scraper, or on demand
+via ``python row_store.py enriched_broadcasts.csv``.
+
+A binary sidecar index (``<csv>.idx``) records every row's byte offset and
+which tracked columns are filled, so startup can find recent incomplete rows
+by reading the tail of the index and load a single row lazily with one seek
+instead of parsing the whole CSV.
+"""
+
+import csv
+import io
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+
+INDEX_MAGIC = b"BCSTIDX1"
+INDEX_HEADER = struct.Struct("<8sQ")  # magic, generation
+# broadcast id, row offset, row length, filled-column flags, kind, written at, CSV size after the write
+INDEX_RECORD = struct.Struct("<48sQIBBdQ")
+KIND_ROW = 0
+KIND_PATCH = 1
+
+log = logging.getLogger(__name__)
+
+
+def _iter_raw_rows(f):
+    # Yields (offset, bytes) per CSV record; quoted fields may span lines, so a
+    # record is complete once its quote count is even. A torn trailing record is dropped.
+    offset = f.tell()
+    chunk = b""
+    for line in iter(f.readline, b""):
+        chunk += line
+        if chunk.count(b'"') % 2 == 0 and chunk.endswith(b"\n"):
+            yield offset, chunk
+            offset += len(chunk)
+            chunk = b""
+
+
+def _parse_raw_row(raw):
+    return next(csv.reader(io.StringIO(raw.decode("utf-8"), newline="")))
+
+
+def _row_formatter(columns):
+    # Each formatter has its own buffer: the store's is used under its lock, compaction's outside it.
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+
+    def format_row(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue().encode("utf-8")
+
+    return format_row
+
+
+def _created_at_seconds(value):
+    try:
+        return float(value) / 1000.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RowStore:
+    def __init__(self, csv_path, columns, compact_interval=300, compact_patch_ratio=0.25, tracked_columns=()):
+        self.csv_path = csv_path
+        self.patch_path = csv_path + ".patches"
+        self.index_path = csv_path + ".idx"
+        self.columns = columns
+        self.tracked_columns = list(tracked_columns)
+        self._full_flags = (1 << len(self.tracked_columns)) - 1
+        self.compact_interval = compact_interval
+        self.compact_patch_ratio = compact_patch_ratio
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._csv_file = None
+        self._patch_file = None
+        self._index_file = None
+        self._format_row = _row_formatter(columns)
+        self._pending = {}
+        self._pending_patches = 0
+        self._patch_bytes = 0
+        self._last_compact = time.time()
+        self.generation = 0
+
+        if not os.path.exists(csv_path):
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                csv.DictWriter(f, fieldnames=columns).writeheader()
+        if os.path.exists(self.patch_path):
+            with open(self.patch_path, "r", encoding="utf-8") as f:
+                self._pending_patches = sum(1 for line in f if line.strip())
+            self._patch_bytes = os.path.getsize(self.patch_path)
+        if not self._index_is_valid():
+            log.info("Rebuilding row index %s...", self.index_path)
+            self._rebuild_index()
+        self._open()
+        with open(csv_path, "rb") as f:
+            header = _parse_raw_row(f.readline())
+        if header != list(columns):
+            # New columns (or a new order): rewrite once so appended rows match the header.
+            log.info("Migrating %s to the current column set...", csv_path)
+            # load_pending has not run yet, so nothing is pending; rows keep what the index says.
+            self.compact(settle=False)
+
+    def _open(self):
+        self._csv_file = open(self.csv_path, "ab")
+        self._patch_file = open(self.patch_path, "a", encoding="utf-8")
+        self._index_file = open(self.index_path, "ab")
+
+    def _close(self):
+        for f in (self._csv_file, self._patch_file, self._index_file):
+            if f:
+                f.close()
+        self._csv_file = None
+        self._patch_file = None
+        self._index_file = None
+
+    def _flags(self, values):
+        flags = 0
+        for bit, column in enumerate(self.tracked_columns):
+            if values.get(column) not in (None, ""):
+                flags |= 1 << bit
+        return flags
+
+    def _pack_record(self, b_id, offset, length, flags, kind, written_at, csv_size):
+        encoded = b_id.encode("utf-8")
+        if len(encoded) > 48:
+            raise ValueError(f"broadcast id too long for the row index: {b_id}")
+        return INDEX_RECORD.pack(encoded, offset, length, flags, kind, written_at, csv_size)
+
+    def _index_is_valid(self):
+        if not os.path.exists(self.index_path):
+            return False
+        size = os.path.getsize(self.index_path)
+        if size < INDEX_HEADER.size + INDEX_RECORD.size:
+            return False
+        with open(self.index_path, "r+b") as f:
+            magic, generation = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                return False
+            torn = (size - INDEX_HEADER.size) % INDEX_RECORD.size
+            if torn:
+                # A record cut short by a crash; drop it and check the rest.
+                size -= torn
+                f.truncate(size)
+            f.seek(size - INDEX_RECORD.size)
+            last = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+        if last[6] != os.path.getsize(self.csv_path):
+            return False
+        self.generation = generation
+        return True
+
+    def _read_patches(self, limit=None):
+        # Folds the patch log into {id: fields}; ``limit`` stops at that byte offset.
+        patches = {}
+        if not os.path.exists(self.patch_path):
+            return patches
+        with open(self.patch_path, "rb") as f:
+            position = 0
+            for line in f:
+                position += len(line)
+                if limit is not None and position > limit:
+                    break
+                line = line.decode("utf-8").strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write; everything before it is intact.
+                    continue
+                patches.setdefault(record["id"], {}).update(record["fields"])
+        return patches
+
+    def _rebuild_index(self):
+        patches = self._read_patches()
+        generation = random.getrandbits(63)
+        tmp_path = self.index_path + ".tmp"
+        with open(self.csv_path, "r+b") as src, open(tmp_path, "wb") as dst:
+            dst.write(INDEX_HEADER.pack(INDEX_MAGIC, generation))
+            header = _parse_raw_row(src.readline())
+            end = src.tell()
+            # Write times are lost; the latest created_at so far stands in for them, kept non-decreasing
+            # so load_pending's backwards scan does not stop early at an old or unparsable row.
+            written_at = 0.0
+            for offset, raw in _iter_raw_rows(src):
+                row = dict(zip(header, _parse_raw_row(raw)))
+                row.update(patches.get(row.get("broadcast_id"), {}))
+                end = offset + len(raw)
+                written_at = max(written_at, _created_at_seconds(row.get("created_at")))
+                dst.write(self._pack_record(row.get("broadcast_id", ""), offset, len(raw), self._flags(row),
+                                            KIND_ROW, written_at, end))
+            if src.seek(0, os.SEEK_END) != end:
+                log.warning("Dropping torn trailing row from %s.", self.csv_path)
+                src.truncate(end)
+            if dst.tell() == INDEX_HEADER.size:
+                # No rows yet: one placeholder record pins the CSV size the index was built against.
+                dst.write(self._pack_record("", 0, 0, 0, KIND_PATCH, time.time(), end))
+        os.replace(tmp_path, self.index_path)
+        self.generation = generation
+
+    def load_pending(self, window):
+        """Read the index tail and remember rows written within ``window`` seconds that are still incomplete."""
+        cutoff = time.time() - window
+        latest = {}
+        with self._lock, open(self.index_path, "rb") as f:
+            size = os.path.getsize(self.index_path)
+            if size <= INDEX_HEADER.size:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = size - INDEX_RECORD.size
+                while pos >= INDEX_HEADER.size:
+                    raw_id, offset, length, flags, kind, written_at, _ = INDEX_RECORD.unpack_from(mm, pos)
+                    pos -= INDEX_RECORD.size
+                    b_id = raw_id.rstrip(b"\0").decode("utf-8")
+                    if not b_id:
+                        # Placeholders and rows without an id carry no write time worth stopping at.
+                        continue
+                    # Write times only grow along the index, so everything before this record is older.
+                    if written_at < cutoff:
+                        break
+                    if b_id not in latest:
+                        latest[b_id] = (offset, length, flags)
+            for b_id, (offset, length, flags) in latest.items():
+                if flags != self._full_flags:
+                    self._pending[b_id] = (offset, length, flags)
+            return len(self._pending)
+
+    def pending_ids(self):
+        with self._lock:
+            return list(self._pending)
+
+    def drop_pending(self, b_ids):
+        """Stop tracking rows nothing will patch again; the index records them as settled so load_pending skips them."""
+        with self._lock:
+            records = []
+            for b_id in b_ids:
+                entry = self._pending.pop(b_id, None)
+                if entry is not None:
+                    records.append(self._pack_record(b_id, entry[0], entry[1], self._full_flags, KIND_PATCH,
+                                                     time.time(), self._csv_file.tell()))
+            if records:
+                self._index_file.write(b"".join(records))
+                self._index_file.flush()
+
+    def index_position(self):
+        with self._lock:
+            self._index_file.flush()
+            return self.generation, self._index_file.tell()
+
+    def ids_since(self, marker):
+        """Yield ids of rows indexed after ``marker`` (from ``index_position``), or all ids if it is stale."""
+        start = INDEX_HEADER.size
+        if marker and marker[0] == self.generation:
+            start = max(start, marker[1])
+        with self._lock:
+            self._index_file.flush()
+        with open(self.index_path, "rb") as f:
+            f.seek(start)
+            while True:
+                block = f.read(INDEX_RECORD.size * 4096)
+                block = block[:len(block) - len(block) % INDEX_RECORD.size]
+                if not block:
+                    return
+                for raw_id, _, _, _, kind, _, _ in INDEX_RECORD.iter_unpack(block):
+                    if kind == KIND_ROW:
+                        yield raw_id.rstrip(b"\0").decode("utf-8")
+
+    def contains(self, b_id):
+        """Whether a row for ``b_id`` was ever stored; scans the index, so only for confirming Bloom hits."""
+        key = b_id.encode("utf-8")
+        if not key or len(key) > 48:
+            return False
+        key = key.ljust(48, b"\0")
+        with self._lock:
+            self._index_file.flush()
+        with open(self.index_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < INDEX_HEADER.size + INDEX_RECORD.size:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = mm.find(key, INDEX_HEADER.size)
+                while pos != -1:
+                    # The id has to start a record, and that record has to be a row rather than a patch.
+                    if (pos - INDEX_HEADER.size) % INDEX_RECORD.size == 0 and mm[pos + 61] == KIND_ROW:
+                        return True
+                    pos = mm.find(key, pos + 1)
+        return False
+
+    def get(self, b_id):
+        """Load one pending row from disk with its patches applied, or None if it is not pending."""
+        with self._lock:
+            entry = self._pending.get(b_id)
+            if entry is None:
+                return None
+            self._csv_file.flush()
+            self._patch_file.flush()
+            offset, length, _ = entry
+            with open(self.csv_path, "rb") as f:
+                f.seek(offset)
+                row = dict(zip(self.columns, _parse_raw_row(f.read(length))))
+            with open(self.patch_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if b_id not in line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record["id"] == b_id:
+                        row.update(record["fields"])
+        return {k: (None if v == "" else v) for k, v in row.items()}
+
+    def load(self):
+        """Yield every stored row with pending patches applied."""
+        with self._lock:
+            self._csv_file.flush()
+            self._patch_file.flush()
+            patches = self._read_patches()
+            with open(self.csv_path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    fields = patches.get(row.get("broadcast_id"))
+                    if fields:
+                        row.update(fields)
+                    yield row
+
+    def append(self, row):
+        b_id = row.get("broadcast_id", "")
+        flags = self._flags(row)
+        with self._lock:
+            raw = self._format_row(row)
+            offset = self._csv_file.tell()
+            self._csv_file.write(raw)
+            self._csv_file.flush()
+            self._index_file.write(self._pack_record(b_id, offset, len(raw), flags, KIND_ROW, time.time(), offset + len(raw)))
+            self._index_file.flush()
+            if flags != self._full_flags:
+                self._pending[b_id] = (offset, len(raw), flags)
+
+    def append_many(self, rows, pending=True):
+        """Append rows with one write to each file, like append() per row. pending=False is for rows nothing
+        will patch (backfilled history): they are indexed as settled, as drop_pending() does, not as pending."""
+        if not rows:
+            return
+        now = time.time()
+        with self._lock:
+            offset = self._csv_file.tell()
+            raws, records = [], []
+            for row in rows:
+                b_id = row.get("broadcast_id", "")
+                flags = self._flags(row) if pending else self._full_flags
+                raw = self._format_row(row)
+                raws.append(raw)
+                records.append(self._pack_record(b_id, offset, len(raw), flags, KIND_ROW, now, offset + len(raw)))
+                if flags != self._full_flags:
+                    self._pending[b_id] = (offset, len(raw), flags)
+                offset += len(raw)
+            self._csv_file.write(b"".join(raws))
+            self._csv_file.flush()
+            self._index_file.write(b"".join(records))
+            self._index_file.flush()
+
+    def patch(self, b_id, fields):
+        record = json.dumps({"id": b_id, "fields": fields})
+        with self._lock:
+            self._patch_file.write(record + "\n")
+            self._patch_file.flush()
+            self._pending_patches += 1
+            self._patch_bytes += len(record) + 1
+            entry = self._pending.get(b_id)
+            if entry is None:
+                return
+            offset, length, flags = entry
+            flags |= self._flags(fields)
+            self._index_file.write(self._pack_record(b_id, offset, length, flags, KIND_PATCH, time.time(),
+                                                     self._csv_file.tell()))
+            self._index_file.flush()
+            if flags == self._full_flags:
+                del self._pending[b_id]
+            else:
+                self._pending[b_id] = (offset, length, flags)
+
+    def compact(self, settle=True):
+        """Rewrite the CSV with all patches applied, rebuild the index and truncate the patch log.
+
+        With ``settle`` the index marks incomplete rows that are no longer pending as settled, as
+        drop_pending did, so load_pending does not pick them up again. Without it (nothing has been
+        loaded as pending yet) rows keep whatever the current index says about them.
+
+        The rewrite covers the files as they stood when it started and runs without the store lock,
+        so appends and patches carry on meanwhile; the lock is held again only to carry over what
+        they wrote and swap the files in.
+        """
+        with self._compact_lock:
+            with self._lock:
+                for f in (self._csv_file, self._patch_file, self._index_file):
+                    f.flush()
+                csv_end = self._csv_file.tell()
+                patch_end = os.path.getsize(self.patch_path)
+                index_end = self._index_file.tell()
+                snapshot_pending = set(self._pending)
+                stamp = time.time()
+
+            patches = self._read_patches(patch_end)
+            format_row = _row_formatter(self.columns)
+            # Settled compactions know what is pending, so rewritten rows count as written now. Otherwise
+            # (before load_pending) their created_at stands in, as in _rebuild_index, so the window still applies.
+            written_at = 0.0
+            if not settle:
+                # Row records are in CSV order, so they are read alongside the rows; drop_pending's are patches.
+                settled_ids = {b_id for b_id, kind, flags in self._indexed_records(index_end)
+                               if kind == KIND_PATCH and flags == self._full_flags}
+                indexed_rows = ((b_id, flags) for b_id, kind, flags in self._indexed_records(index_end)
+                                if kind == KIND_ROW)
+            generation = random.getrandbits(63)
+            moved = {}
+            tmp_path = self.csv_path + ".tmp"
+            tmp_index_path = self.index_path + ".tmp"
+            tmp_patch_path = self.patch_path + ".tmp"
+            with open(self.csv_path, "rb") as src, open(tmp_path, "wb") as dst, \
+                    open(tmp_index_path, "wb") as idx:
+                header = _parse_raw_row(src.readline())
+                dst.write(",".join(self.columns).encode("utf-8") + b"\r\n")
+                idx.write(INDEX_HEADER.pack(INDEX_MAGIC, generation))
+                for old_offset, raw in _iter_raw_rows(src):
+                    if old_offset >= csv_end:
+                        break
+                    row = dict(zip(header, _parse_raw_row(raw)))
+                    b_id = row.get("broadcast_id", "")
+                    row.update(patches.get(b_id, {}))
+                    raw = format_row({c: row.get(c) for c in self.columns})
+                    offset = dst.tell()
+                    dst.write(raw)
+                    if settle:
+                        settled = b_id not in snapshot_pending
+                    else:
+                        indexed = next(indexed_rows, None)
+                        settled = b_id in settled_ids or indexed == (b_id, self._full_flags)
+                    flags = self._full_flags if settled else self._flags(row)
+                    written_at = stamp if settle else max(written_at, _created_at_seconds(row.get("created_at")))
+                    idx.write(self._pack_record(b_id, offset, len(raw), flags, KIND_ROW, written_at, offset + len(raw)))
+                    if b_id in snapshot_pending:
+                        moved[b_id] = (offset, len(raw))
+                # Sync the bulk now, so the fsync under the lock below only has the carried-over tail to write.
+                for f in (dst, idx):
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                with self._lock:
+                    self._close()
+                    try:
+                        self._carry_over(src, dst, idx, csv_end, index_end, moved)
+                        with open(self.patch_path, "rb") as old_patches, open(tmp_patch_path, "wb") as new_patches:
+                            old_patches.seek(patch_end)
+                            tail = old_patches.read()
+                            new_patches.write(tail)
+                        for f in (dst, idx):
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(tmp_path, self.csv_path)
+                        os.replace(tmp_index_path, self.index_path)
+                        os.replace(tmp_patch_path, self.patch_path)
+                        self.generation = generation
+                        self._pending_patches = tail.count(b"\n")
+                        self._patch_bytes = len(tail)
+                        self._last_compact = time.time()
+                    finally:
+                        self._open()
+
+    def _indexed_records(self, end):
+        # Yields (id, kind, flags) for the index records before byte ``end``, in order.
+        with open(self.index_path, "rb") as f:
+            f.seek(INDEX_HEADER.size)
+            remaining = end - INDEX_HEADER.size
+            while remaining > 0:
+                block = f.read(min(remaining, INDEX_RECORD.size * 4096))
+                remaining -= len(block)
+                block = block[:len(block) - len(block) % INDEX_RECORD.size]
+                if not block:
+                    return
+                for raw_id, _, _, flags, kind, _, _ in INDEX_RECORD.iter_unpack(block):
+                    yield raw_id.rstrip(b"\0").decode("utf-8"), kind, flags
+
+    def _carry_over(self, src, dst, idx, csv_end, index_end, moved):
+        # Rows appended and patches indexed while the snapshot was being rewritten keep their
+        # place after it; their patch log lines stay unapplied in the new patch log.
+        base = dst.tell()
+        src.seek(csv_end)
+        for block in iter(lambda: src.read(1 << 20), b""):
+            dst.write(block)
+
+        def relocate(b_id, offset, length):
+            if offset >= csv_end:
+                return offset - csv_end + base, length
+            return moved.get(b_id)
+
+        with open(self.index_path, "rb") as old_index:
+            old_index.seek(index_end)
+            block = old_index.read()
+        block = block[:len(block) - len(block) % INDEX_RECORD.size]
+        pinned = base if idx.tell() > INDEX_HEADER.size else None
+        for raw_id, offset, length, flags, kind, written_at, csv_size in INDEX_RECORD.iter_unpack(block):
+            b_id = raw_id.rstrip(b"\0").decode("utf-8")
+            place = relocate(b_id, offset, length)
+            if place is not None:
+                pinned = csv_size - csv_end + base
+                idx.write(self._pack_record(b_id, place[0], place[1], flags, kind, written_at, pinned))
+        if pinned != dst.tell():
+            # The last record must carry the CSV size, or the next start rebuilds the index.
+            idx.write(self._pack_record("", 0, 0, 0, KIND_PATCH, time.time(), dst.tell()))
+
+        pending = {}
+        for b_id, (offset, length, flags) in self._pending.items():
+            place = relocate(b_id, offset, length)
+            if place is not None:
+                pending[b_id] = (place[0], place[1], flags)
+        self._pending = pending
+
+    def maybe_compact(self):
+        """Compact once the interval has passed, or sooner once the patch log outgrows its share of the CSV."""
+        with self._lock:
+            if not self._pending_patches:
+                return False
+            oversized = self._patch_bytes >= self.compact_patch_ratio * self._csv_file.tell()
+        if oversized or time.time() - self._last_compact >= self.compact_interval:
+            self.compact()
+            return True
+        return False
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "enriched_broadcasts.csv"
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    from schema import VARIANCE_COLUMNS
+    store = RowStore(path, header, tracked_columns=[column for column in VARIANCE_COLUMNS if column in header])
+    # Nothing is loaded as pending here, so rows keep what the index says about them.
+    store.compact(settle=False)
+    store.close()
+    print(f"Compacted {path}.")
@@ -0,0 +1,210 @@
+"""Compact, schema-generated row type for in-memory broadcast rows.
+
+A plain dict per row repeats ~90 key pointers and boxes every number. The
+generated class keeps every typed column in one ``bytes`` buffer: numeric
+columns as doubles (NaN for None), then one bit per numeric slot recording
+whether the value was an int (the API returns ints for many float columns),
+then two bits per boolean or 0/1 flag column. The buffer is rebuilt on each
+write, which is cheap next to the few writes a row ever gets and saves the
+separate object a ``bytearray`` would need. Text columns are interned
+strings in the class's own slots. A value that does not fit its column's
+packed type exactly (an int beyond 2**53, a float in an int column, ...) is
+kept as-is in a small per-row overflow dict, so reading a row back always
+returns what was stored. Rows read back from the CSV go through
+``from_text``, which restores each column's type where the text round-trips.
+"""
+
+import math
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+NUMERIC_KINDS = ("float", "int")
+BIT_KINDS = ("bool", "flag")
+MAX_EXACT_INT = 2 ** 53
+DOUBLE = struct.Struct("<d")
+
+
+def _pack(kind, value):
+    # Returns (float to store, whether value is an int), or None if it can't be packed losslessly.
+    if value is None:
+        return math.nan, False
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return (float(value), True) if -MAX_EXACT_INT <= value <= MAX_EXACT_INT else None
+    if kind == "float" and isinstance(value, float) and not math.isnan(value):
+        return value, False
+    return None
+
+
+def _pack_bits(kind, value):
+    # 0 = None, 1 = False/0, 2 = True/1; None if the value isn't one of those.
+    if value is None:
+        return 0
+    if kind == "bool":
+        return 2 if value is True else 1 if value is False else None
+    if isinstance(value, bool) or value not in (0, 1) or not isinstance(value, int):
+        return None
+    return value + 1
+
+
+def _unpack(stored, is_int):
+    if math.isnan(stored):
+        return None
+    return int(stored) if is_int else stored
+
+
+def _parse_text(kind, text):
+    # The typed value the CSV writer turned into ``text``, or ``text`` itself if none writes back identically.
+    if kind in NUMERIC_KINDS or kind == "flag":
+        try:
+            value = int(text)
+        except ValueError:
+            try:
+                value = float(text)
+            except ValueError:
+                return text
+        return value if str(value) == text else text
+    if kind == "bool":
+        return {"True": True, "False": False}.get(text, text)
+    return text
+
+
+class CompactRow(Mapping):
+    __slots__ = ("_packed", "_extra")
+    columns = ()
+    _layout = {}
+    _text_slots = ()
+    _ints_at = 0
+    _bits_at = 0
+    _template = b""
+
+    def __init__(self, values=None):
+        self._packed = self._template
+        self._extra = None
+        for slot in self._text_slots:
+            setattr(self, slot, None)
+        if values:
+            self.update(values)
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values)
+
+    @classmethod
+    def from_text(cls, values):
+        """Build a row from CSV text (e.g. ``RowStore.get``), parsing each value back to its column's type."""
+        return cls({key: _parse_text(cls._layout[key][0], value) if isinstance(value, str) else value
+                    for key, value in values.items()})
+
+    def __getitem__(self, key):
+        kind, index = self._layout[key]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        if kind in NUMERIC_KINDS:
+            stored = DOUBLE.unpack_from(self._packed, 8 * index)[0]
+            return _unpack(stored, (self._packed[self._ints_at + (index >> 3)] >> (index & 7)) & 1)
+        if kind in BIT_KINDS:
+            code = (self._packed[self._bits_at + (index >> 2)] >> (2 * (index & 3))) & 3
+            if code == 0:
+                return None
+            return code == 2 if kind == "bool" else code - 1
+        return getattr(self, index)
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def _store(self, packed, key, value):
+        kind, index = self._layout[key]
+        if self._extra is not None:
+            self._extra.pop(key, None)
+            if not self._extra:
+                self._extra = None
+        if kind in NUMERIC_KINDS:
+            fitted = _pack(kind, value)
+            at, bit = self._ints_at + (index >> 3), 1 << (index & 7)
+            if fitted is not None:
+                DOUBLE.pack_into(packed, 8 * index, fitted[0])
+                if fitted[1]:
+                    packed[at] |= bit
+                else:
+                    packed[at] &= ~bit
+                return
+            DOUBLE.pack_into(packed, 8 * index, math.nan)
+            packed[at] &= ~bit
+        elif kind in BIT_KINDS:
+            code = _pack_bits(kind, value)
+            at, shift = self._bits_at + (index >> 2), 2 * (index & 3)
+            packed[at] &= ~(3 << shift)
+            if code is not None:
+                packed[at] |= code << shift
+                return
+        else:
+            if isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, index, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, key):
+        return key in self._layout
+
+    def update(self, values):
+        packed = bytearray(self._packed)
+        for key, value in values.items():
+            self._store(packed, key, value)
+        self._packed = bytes(packed)
+
+    def to_dict(self):
+        return {key: self[key] for key in self.columns}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self) + self._packed.__sizeof__()
+        if self._extra is not None:
+            size += self._extra.__sizeof__()
+        return size
+
+
+def make_row_class(columns, kinds, name="BroadcastRow"):
+    """Build a CompactRow subclass for ``columns``; ``kinds`` maps column -> float/int/bool/flag/str (default str)."""
+    layout = {}
+    num_count = 0
+    bit_count = 0
+    text_slots = []
+    for column in columns:
+        kind = kinds.get(column, "str")
+        if kind in NUMERIC_KINDS:
+            layout[column] = (kind, num_count)
+            num_count += 1
+        elif kind in BIT_KINDS:
+            layout[column] = (kind, bit_count)
+            bit_count += 1
+        else:
+            slot = f"_text{len(text_slots)}"
+            layout[column] = (kind, slot)
+            text_slots.append(slot)
+    ints_at = 8 * num_count
+    bits_at = ints_at + (num_count + 7) // 8
+    template = b"".join(DOUBLE.pack(math.nan) for _ in range(num_count)) + bytes(bits_at - ints_at + (bit_count + 3) // 4)
+    return type(name, (CompactRow,), {
+        "__slots__": tuple(text_slots),
+        "columns": tuple(columns),
+        "_layout": layout,
+        "_text_slots": tuple(text_slots),
+        "_ints_at": ints_at,
+        "_bits_at": bits_at,
+        "_template": template,
+    })
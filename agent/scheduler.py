@@ -0,0 +1,78 @@
+"""Single-thread timer scheduler backed by a heap of due times.
+
+One timer thread sleeps until the earliest deadline and hands everything
+that is due to a small fixed worker pool, so the number of threads stays
+constant no matter how many checks are pending.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class TimerScheduler:
+    def __init__(self, handler, workers=4, batch_window=0.0):
+        # handler is called on a worker thread with a list of payloads whose
+        # due time has passed (or falls within batch_window of the earliest one).
+        self.handler = handler
+        self.batch_window = batch_window
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="variance")
+        self._thread = threading.Thread(target=self._run, name="timer-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self._pool.shutdown(wait=False)
+
+    def schedule(self, due, payload):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), payload))
+            if self._heap[0][2] is payload:
+                self._cond.notify()
+
+    def fire(self, batch):
+        """Hand a batch of payloads straight to a worker, e.g. checks that came due while stopped."""
+        self._pool.submit(self._dispatch, list(batch))
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+                cutoff = self._heap[0][0] + self.batch_window
+                batch = []
+                while self._heap and self._heap[0][0] <= cutoff:
+                    batch.append(heapq.heappop(self._heap)[2])
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            self.handler(batch)
+        except Exception:
+            log.exception("Handler failed for a batch of %d", len(batch))
@@ -0,0 +1,197 @@
+"""Declarative column spec for enriched broadcast rows.
+
+Each ``Column`` says where its value comes from -- a path into the feed
+broadcast, the user profile or the buy token response -- and optionally how
+it is derived, either from that raw value or from other columns. ``transform``
+applies the whole spec to a batch of nodes one column at a time, so adding a
+feature means adding a ``Column`` here rather than touching the scraper loop.
+
+Lookups follow the scraper's original ``.get()`` rules: intermediate objects
+that are missing or null become ``{}``, and the default only applies when the
+final key is absent.
+"""
+
+
+class Column:
+    __slots__ = ("name", "source", "default", "inputs", "derive", "kind")
+
+    def __init__(self, name, source=None, default=None, inputs=(), derive=None, kind="str"):
+        # source: ("broadcast" | "profile" | "token", key, ...); derive maps whole
+        # columns to a column: derive(raw_values) with a source, else derive(*input_columns).
+        self.name = name
+        self.source = source
+        self.default = default
+        self.inputs = tuple(inputs)
+        self.derive = derive
+        self.kind = kind
+
+
+def _getter(path, default):
+    root, keys = path[0], path[1:]
+
+    def get(node):
+        value = node.get(root) or {}
+        for key in keys[:-1]:
+            value = value.get(key) or {}
+        return value.get(keys[-1], default)
+
+    return get
+
+
+def has(values):
+    return [1 if v else 0 for v in values]
+
+
+def positive(values):
+    return [1 if v and v > 0 else 0 for v in values]
+
+
+def top100(values):
+    return [1 if (v and v <= 100) else 0 for v in values]
+
+
+def total(values):
+    return [sum(v) if v else 0 for v in values]
+
+
+def equals(expected):
+    return lambda values: [1 if v == expected else 0 for v in values]
+
+
+def _flag(name, input_name, derive=has):
+    return Column(name, inputs=[input_name], derive=derive, kind="flag")
+
+
+def _token(name, key, default, kind):
+    return Column(f"buy_token_{name}", ("token", key), default, kind=kind)
+
+
+SCHEMA = [
+    Column("broadcast_id", ("broadcast", "id"), ""),
+    Column("created_at", ("broadcast", "createdAt"), "", kind="int"),
+    Column("user_id", ("broadcast", "profile", "id"), ""),
+    Column("user_username", ("broadcast", "profile", "username"), ""),
+    Column("buy_token_id", ("broadcast", "buyTokenId"), ""),
+    Column("buy_token_amount", ("broadcast", "buyTokenAmount"), 0),
+    Column("buy_token_price_bcast", ("broadcast", "buyTokenPrice"), 0.0, kind="float"),
+    Column("buy_token_mcap_bcast", ("broadcast", "buyTokenMCap"), 0.0, kind="float"),
+    Column("sell_token_id", ("broadcast", "sellTokenId"), ""),
+    Column("sell_token_amount", ("broadcast", "sellTokenAmount"), 0),
+    Column("sell_token_price_bcast", ("broadcast", "sellTokenPrice"), 0.0, kind="float"),
+    Column("sell_token_mcap_bcast", ("broadcast", "sellTokenMCap"), 0.0, kind="float"),
+    _flag("broadcast_has_buy_token", "buy_token_id"),
+    _flag("broadcast_has_sell_token", "sell_token_id"),
+    Column("user_twitter_username", ("profile", "twitterUsername"), None),
+    Column("user_is_verified", ("profile", "isVerified"), False, kind="bool"),
+    _flag("user_is_verified_binary", "user_is_verified"),
+    Column("user_follower_count", ("profile", "followerCount"), 0, kind="int"),
+    Column("user_followee_count", ("profile", "followeeCount"), 0, kind="int"),
+    Column("user_mutual_follower_count", ("profile", "mutualFollowersV2", "totalCount"), 0, kind="int"),
+    _flag("user_mutual_followers_binary", "user_mutual_follower_count", positive),
+    Column("user_visibility", ("profile", "visibility"), "PUBLIC"),
+    _flag("user_visible_public", "user_visibility", equals("PUBLIC")),
+    Column("user_weekly_rank", ("profile", "weeklyLeaderboardStanding", "rank"), None, kind="int"),
+    Column("user_weekly_value", ("profile", "weeklyLeaderboardStanding", "value"), 0.0, kind="float"),
+    _flag("user_weekly_rank_is_top100", "user_weekly_rank", top100),
+    Column("user_best_rank", ("profile", "bestEverStanding", "rank"), None, kind="int"),
+    Column("user_best_rank_value", ("profile", "bestEverStanding", "value"), 0.0, kind="float"),
+    _flag("user_best_rank_is_top100", "user_best_rank", top100),
+    Column("user_top_three_pnl_win_total", ("profile", "topThreePnlWin"), [], derive=total, kind="float"),
+    Column("user_top_three_pnl_loss_total", ("profile", "topThreePnlLoss"), [], derive=total, kind="float"),
+    Column("user_top_three_volume_total", ("profile", "topThreeVolume"), [], derive=total, kind="float"),
+    Column("user_daily_pnl", ("profile", "profileLeaderboardValues", "daily", "pnl"), 0.0, kind="float"),
+    Column("user_daily_volume", ("profile", "profileLeaderboardValues", "daily", "volume"), 0.0, kind="float"),
+    Column("user_weekly_pnl", ("profile", "profileLeaderboardValues", "weekly", "pnl"), 0.0, kind="float"),
+    Column("user_weekly_volume", ("profile", "profileLeaderboardValues", "weekly", "volume"), 0.0, kind="float"),
+    Column("user_subscriber_count", ("profile", "subscriberCountV2"), 0, kind="int"),
+    _flag("user_has_subscribers", "user_subscriber_count", positive),
+    Column("user_followed_by_you", ("profile", "followedByProfile"), False, kind="bool"),
+    _flag("user_followed_by_you_binary", "user_followed_by_you"),
+    Column("user_subscribed_by_you", ("profile", "subscribedByProfileV2"), False, kind="bool"),
+    _flag("user_subscribed_by_you_binary", "user_subscribed_by_you"),
+    _flag("user_has_twitter", "user_twitter_username"),
+    _token("name", "name", "", "str"),
+    _token("symbol", "symbol", "", "str"),
+    _token("price", "price", 0.0, "float"),
+    _token("supply", "supply", 0, "str"),
+    _token("chain", "chain", "", "str"),
+    _token("liquidity", "liquidity", 0, "float"),
+    _flag("buy_token_has_liquidity", "buy_token_liquidity", positive),
+    _token("volume24h", "volume24h", 0.0, "float"),
+    _token("volume6h", "volume6h", 0.0, "float"),
+    _token("volume1h", "volume1h", 0.0, "float"),
+    _token("volume5min", "volume5min", 0.0, "float"),
+    _token("buyVolume24h", "buyVolume24h", 0.0, "float"),
+    _token("sellVolume24h", "sellVolume24h", 0.0, "float"),
+    _token("buyVolume6h", "buyVolume6h", 0.0, "float"),
+    _token("sellVolume6h", "sellVolume6h", 0.0, "float"),
+    _token("buyVolume1h", "buyVolume1h", 0.0, "float"),
+    _token("sellVolume1h", "sellVolume1h", 0.0, "float"),
+    _token("buyVolume5min", "buyVolume5min", 0.0, "float"),
+    _token("sellVolume5min", "sellVolume5min", 0.0, "float"),
+    _token("buyCount24h", "buyCount24h", 0, "int"),
+    _token("sellCount24h", "sellCount24h", 0, "int"),
+    _token("buyCount6h", "buyCount6h", 0, "int"),
+    _token("sellCount6h", "sellCount6h", 0, "int"),
+    _token("buyCount1h", "buyCount1h", 0, "int"),
+    _token("sellCount1h", "sellCount1h", 0, "int"),
+    _token("buyCount5min", "buyCount5min", 0, "int"),
+    _token("sellCount5min", "sellCount5min", 0, "int"),
+    _token("verified", "verified", False, "bool"),
+    _flag("buy_token_is_verified", "buy_token_verified"),
+    _token("jupVerified", "jupVerified", False, "bool"),
+    _flag("buy_token_is_jupVerified", "buy_token_jupVerified"),
+    _token("freezable", "freezable", False, "bool"),
+    _flag("buy_token_is_freezable", "buy_token_freezable"),
+    _token("twitter", "twitter", None, "str"),
+    _flag("buy_token_has_twitter", "buy_token_twitter"),
+    _token("telegram", "telegram", None, "str"),
+    _flag("buy_token_has_telegram", "buy_token_telegram"),
+    _token("website", "website", None, "str"),
+    _flag("buy_token_has_website", "buy_token_website"),
+    _token("discord", "discord", None, "str"),
+    _flag("buy_token_has_discord", "buy_token_discord"),
+    _token("top10HolderPercent", "top10HolderPercent", 0.0, "float"),
+    _token("top10HolderPercentV2", "top10HolderPercentV2", 0.0, "float"),
+    # Filled in later by the variance checks.
+    Column("price_30s_variance", kind="float"),
+    Column("price_1m_variance", kind="float"),
+    Column("price_5m_variance", kind="float"),
+    Column("won_30s", kind="bool"),
+    Column("won_1m", kind="bool"),
+    Column("won_5m", kind="bool"),
+    # Sampled price path over the 5m horizon: peak relative to the broadcast price, and the
+    # largest fall from a running peak (seeded with the broadcast price), in percent (<= 0).
+    Column("price_5m_peak_variance", kind="float"),
+    Column("price_5m_max_drawdown", kind="float"),
+    # True on rows written by backfill: their profile fields are as of the backfill rather than the
+    # broadcast, and their market fields and variance checks are left empty.
+    Column("backfilled", kind="bool"),
+]
+
+COLUMN_NAMES = [column.name for column in SCHEMA]
+# The columns the scraper's variance checks fill in (apib.HORIZONS); the stores track rows until all are set.
+VARIANCE_COLUMNS = ["price_30s_variance", "price_1m_variance", "price_5m_variance"]
+COLUMN_KINDS = {column.name: column.kind for column in SCHEMA}
+_GETTERS = {column.name: _getter(column.source, column.default) for column in SCHEMA if column.source}
+
+
+def transform(nodes, schema=SCHEMA):
+    """Apply ``schema`` to nodes ({"broadcast", "profile", "token"} dicts) and return {column: values}."""
+    data = {}
+    for column in schema:
+        if column.source:
+            getter = _GETTERS.get(column.name) or _getter(column.source, column.default)
+            values = [getter(node) for node in nodes]
+            data[column.name] = column.derive(values) if column.derive else values
+        elif column.derive:
+            data[column.name] = column.derive(*[data[name] for name in column.inputs])
+        else:
+            data[column.name] = [column.default] * len(nodes)
+    return data
+
+
+def build_rows(nodes, row_factory=dict, schema=SCHEMA):
+    data = transform(nodes, schema)
+    names = [column.name for column in schema]
+    return [row_factory(dict(zip(names, values))) for values in zip(*(data[name] for name in names))]
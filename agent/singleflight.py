@@ -0,0 +1,75 @@
+"""Coalesces concurrent identical requests into one.
+
+The first caller for a key becomes its leader and does the work; callers
+asking for the same key while it is in flight wait for the leader and get
+the same result, or the same exception. Nothing is kept once the call is
+over -- caching stays the caller's business.
+
+``do`` covers the single-request case. ``begin`` / ``finish`` / ``fail``
+let a caller lead several keys with one batched request while it follows
+the keys someone else is already fetching.
+"""
+
+import threading
+
+
+class Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def begin(self, key):
+        """Return (call, True) if the caller now leads key and must finish or fail it, else (call, False)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, value):
+        with self._lock:
+            call = self._calls.pop(key)
+        call.value = value
+        call.event.set()
+
+    def fail(self, key, error):
+        with self._lock:
+            call = self._calls.pop(key)
+        call.error = error
+        call.event.set()
+
+    def do(self, key, fn):
+        call, leader = self.begin(key)
+        if not leader:
+            return call.wait()
+        try:
+            value = fn()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.finish(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
@@ -0,0 +1,231 @@
+"""SQLite storage backend for enriched broadcast rows.
+
+Same interface as ``RowStore`` but every insert and variance update is a
+single-row UPSERT against a WAL-mode database, so nothing has to be held
+in memory or rewritten. ``export_csv()`` produces the same CSV as the flat
+file backend for tools that still read it; run
+``python sqlite_store.py enriched_broadcasts.db enriched_broadcasts.csv``
+to export on demand.
+"""
+
+import csv
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+TABLE = "broadcasts"
+INDEXED_COLUMNS = ["created_at", "user_username", "buy_token_id"]
+# Rows with this column set are never patched (backfilled history), so load_pending skips them.
+SETTLED_COLUMN = "backfilled"
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _adapt(value):
+    # Keep booleans as the same "True"/"False" text the CSV backend writes.
+    if isinstance(value, bool):
+        return str(value)
+    return value
+
+
+class SqliteRowStore:
+    def __init__(self, db_path, columns, export_path=None, export_interval=300, tracked_columns=()):
+        self.db_path = db_path
+        self.columns = columns
+        self.export_path = export_path
+        self.tracked_columns = list(tracked_columns)
+        self._pending = set()
+        self.compact_interval = export_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_compact = time.time()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        quoted = [_quote(c) for c in columns]
+        self._insert_sql = (
+            f"INSERT INTO {TABLE} ({', '.join(quoted)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(broadcast_id) DO UPDATE SET "
+            + ", ".join(f"{q} = excluded.{q}" for q in quoted[1:])
+        )
+
+    def _create_schema(self):
+        if self.columns[0] != "broadcast_id":
+            raise ValueError("broadcast_id must be the first column")
+        column_defs = ", ".join(_quote(c) for c in self.columns[1:])
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (broadcast_id TEXT PRIMARY KEY, {column_defs})")
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({TABLE})")}
+        for column in self.columns:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {_quote(column)}")
+        # broadcast_id is already covered by the primary key index.
+        for column in INDEXED_COLUMNS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_{column} ON {TABLE} ({_quote(column)})")
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+
+    def ids(self):
+        with self._lock:
+            for row in self._conn.execute(f"SELECT broadcast_id FROM {TABLE}"):
+                yield row[0]
+
+    def index_position(self):
+        # Rowids only grow, so the largest one marks how far a snapshot has seen.
+        with self._lock:
+            return 0, self._conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {TABLE}").fetchone()[0]
+
+    def ids_since(self, marker):
+        position = marker[1] if marker else 0
+        with self._lock:
+            for row in self._conn.execute(f"SELECT broadcast_id FROM {TABLE} WHERE rowid > ?", (position,)):
+                yield row[0]
+
+    def load_pending(self, window):
+        if not self.tracked_columns:
+            return 0
+        cutoff_ms = int((time.time() - window) * 1000)
+        incomplete = " OR ".join(f"{_quote(c)} IS NULL" for c in self.tracked_columns)
+        if SETTLED_COLUMN in self.columns:
+            incomplete = f"({incomplete}) AND {_quote(SETTLED_COLUMN)} IS NULL"
+        with self._lock:
+            for row in self._conn.execute(
+                    f"SELECT broadcast_id FROM {TABLE} WHERE created_at >= ? AND ({incomplete})", (cutoff_ms,)):
+                self._pending.add(row[0])
+            return len(self._pending)
+
+    def pending_ids(self):
+        with self._lock:
+            return list(self._pending)
+
+    def drop_pending(self, b_ids):
+        with self._lock:
+            self._pending.difference_update(b_ids)
+
+    def contains(self, b_id):
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM {TABLE} WHERE broadcast_id = ?", (b_id,)).fetchone() is not None
+
+    def get(self, b_id):
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT * FROM {TABLE} WHERE broadcast_id = ?", (b_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([d[0] for d in cursor.description], row))
+
+    def load(self):
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT * FROM {TABLE} ORDER BY rowid")
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        for row in rows:
+            yield dict(zip(names, row))
+
+    def append(self, row):
+        values = [_adapt(row.get(c)) for c in self.columns]
+        with self._lock:
+            self._conn.execute(self._insert_sql, values)
+            self._dirty = True
+
+    def append_many(self, rows, pending=True):
+        # Appends never touch the pending set here; pending is accepted for RowStore parity.
+        values = [[_adapt(row.get(c)) for c in self.columns] for row in rows]
+        if not values:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(self._insert_sql, values)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._dirty = True
+
+    def patch(self, b_id, fields):
+        names = list(fields)
+        quoted = [_quote(n) for n in names]
+        sql = (
+            f"INSERT INTO {TABLE} (broadcast_id, {', '.join(quoted)}) VALUES (?, {', '.join('?' for _ in names)}) "
+            f"ON CONFLICT(broadcast_id) DO UPDATE SET " + ", ".join(f"{q} = excluded.{q}" for q in quoted)
+        )
+        with self._lock:
+            self._conn.execute(sql, [b_id] + [_adapt(fields[n]) for n in names])
+            self._dirty = True
+
+    def import_csv(self, path):
+        count = 0
+        created_at = self.columns.index("created_at") if "created_at" in self.columns else None
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    for row in reader:
+                        if not row.get("broadcast_id"):
+                            continue
+                        values = [row.get(c) if row.get(c) != "" else None for c in self.columns]
+                        if created_at is not None and values[created_at] and values[created_at].isdigit():
+                            # created_at is compared numerically by load_pending().
+                            values[created_at] = int(values[created_at])
+                        self._conn.execute(self._insert_sql, values)
+                        count += 1
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        return count
+
+    def export_csv(self, path):
+        tmp_path = path + ".tmp"
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {', '.join(_quote(c) for c in self.columns)} FROM {TABLE} ORDER BY rowid")
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.columns)
+                for row in cursor:
+                    writer.writerow(row)
+        os.replace(tmp_path, path)
+
+    def compact(self):
+        """Checkpoint the WAL and refresh the exported CSV, if one is configured."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._dirty = False
+            self._last_compact = time.time()
+        if self.export_path:
+            self.export_csv(self.export_path)
+
+    def maybe_compact(self):
+        if not self._dirty or time.time() - self._last_compact < self.compact_interval:
+            return False
+        self.compact()
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def reopen(self):
+        """Give a forked child its own connection; the inherited one is left untouched for the parent."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "enriched_broadcasts.db"
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else "enriched_broadcasts.csv"
+    conn = sqlite3.connect(db_path)
+    header = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")]
+    conn.close()
+    store = SqliteRowStore(db_path, header)
+    store.export_csv(csv_path)
+    store.close()
+    print(f"Exported {db_path} to {csv_path}.")
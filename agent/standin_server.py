@@ -0,0 +1,490 @@
+"""Local GraphQL stand-in for mainnet-api.vector.fun.
+
+Replays recorded broadcasts, profiles and tokens so the scraper can be run
+and benchmarked without network access. New broadcasts are emitted into a
+``feedV3`` at ``--rate`` per second by cloning recorded ones, token prices
+follow a small random walk so variance checks have something to measure,
+and every response waits ``--latency-ms`` (plus jitter) before it is sent.
+``--max-in-flight`` answers 429 with a Retry-After to requests beyond that
+many concurrent ones and ``--error-rate`` fails that share with a 503, to
+exercise the scraper's rate-limit handling.
+
+Responses are projected onto the selection set of the incoming document, so
+aliased and batched queries get exactly the fields they asked for. Fixtures
+default to ones reconstructed from enriched_broadcasts.csv through the column
+schema; ``--fixtures`` loads a JSON file of the same shape instead
+({"broadcasts": [...], "profiles": {username: {...}}, "tokens": {id: {...}}}).
+
+    python standin_server.py --port 8765 --rate 5 --latency-ms 40
+
+``GET /stats`` returns request counts per operation and the emitted broadcasts.
+"""
+
+import argparse
+import copy
+import csv
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from schema import SCHEMA
+
+TOKEN_RE = re.compile(r'\s*(?:(\.\.\.)|([A-Za-z_][A-Za-z0-9_]*)|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|("(?:[^"\\]|\\.)*")|(\$)|([{}()\[\]:!,=@]))')
+
+
+class QueryParseError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    text = re.sub(r"#[^\n]*", "", text)
+    pos = 0
+    tokens = []
+    while pos < len(text):
+        if text[pos:].strip() == "":
+            break
+        match = TOKEN_RE.match(text, pos)
+        if not match:
+            raise QueryParseError(f"unexpected character at {pos}: {text[pos:pos + 20]!r}")
+        pos = match.end()
+        spread, name, number, string, dollar, punct = match.groups()
+        if name:
+            tokens.append(("name", name))
+        elif number:
+            tokens.append(("value", float(number) if any(c in number for c in ".eE") else int(number)))
+        elif string:
+            tokens.append(("value", json.loads(string)))
+        elif dollar:
+            tokens.append(("$", "$"))
+        elif spread:
+            raise QueryParseError("fragments are not supported")
+        else:
+            tokens.append((punct, punct))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text, variables):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.variables = variables or {}
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None):
+        token = self.peek()
+        if kind and token[0] != kind:
+            raise QueryParseError(f"expected {kind}, got {token}")
+        self.pos += 1
+        return token
+
+    def document(self):
+        if self.peek() == ("name", "query"):
+            self.take()
+            if self.peek()[0] == "name":
+                self.take()
+            if self.peek()[0] == "(":
+                self._skip_balanced("(", ")")
+        return self.selection_set()
+
+    def _skip_balanced(self, open_, close):
+        depth = 0
+        while True:
+            kind, _ = self.take()
+            if kind == open_:
+                depth += 1
+            elif kind == close:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def selection_set(self):
+        self.take("{")
+        fields = []
+        while self.peek()[0] != "}":
+            fields.append(self.field())
+            if self.peek()[0] == ",":
+                self.take()
+        self.take("}")
+        return fields
+
+    def field(self):
+        name = self.take("name")[1]
+        alias = name
+        if self.peek()[0] == ":":
+            self.take()
+            name = self.take("name")[1]
+        args = {}
+        if self.peek()[0] == "(":
+            self.take()
+            while self.peek()[0] != ")":
+                arg = self.take("name")[1]
+                self.take(":")
+                args[arg] = self.value()
+                if self.peek()[0] == ",":
+                    self.take()
+            self.take(")")
+        selections = self.selection_set() if self.peek()[0] == "{" else None
+        return alias, name, args, selections
+
+    def value(self):
+        kind, token = self.take()
+        if kind == "$":
+            return self.variables.get(self.take("name")[1])
+        if kind == "value":
+            return token
+        if kind == "name":
+            return {"true": True, "false": False, "null": None}.get(token, token)
+        if kind == "[":
+            items = []
+            while self.peek()[0] != "]":
+                items.append(self.value())
+                if self.peek()[0] == ",":
+                    self.take()
+            self.take("]")
+            return items
+        if kind == "{":
+            obj = {}
+            while self.peek()[0] != "}":
+                key = self.take("name")[1]
+                self.take(":")
+                obj[key] = self.value()
+                if self.peek()[0] == ",":
+                    self.take()
+            self.take("}")
+            return obj
+        raise QueryParseError(f"unexpected token {token!r}")
+
+
+def parse_document(text, variables=None):
+    """Return the root selections of a query as (alias, name, args, selections) tuples."""
+    return _Parser(text, variables).document()
+
+
+def project(value, selections):
+    if selections is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selections) for item in value]
+    result = {}
+    for alias, name, _, sub in selections:
+        field = value.get(alias) if alias in value else value.get(name)
+        result[alias] = project(field, sub)
+    return result
+
+
+def _typed(kind, text):
+    if text == "":
+        return None
+    if kind == "bool":
+        return text == "True"
+    try:
+        if kind == "int":
+            return int(float(text))
+        if kind == "float":
+            return float(text)
+    except ValueError:
+        return text
+    return text
+
+
+def _assign(target, path, value):
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
+
+
+def fixtures_from_csv(path):
+    """Rebuild feed broadcasts, profiles and tokens from an enriched CSV using the schema's source paths."""
+    broadcasts, profiles, tokens = [], {}, {}
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            node = {}
+            for column in SCHEMA:
+                if not column.source or column.name not in row:
+                    continue
+                value = _typed(column.kind, row[column.name])
+                if column.derive is not None:
+                    # Only list totals are derived from a source; replay them as a one-element list.
+                    value = [value] if value else []
+                _assign(node, column.source, value)
+            broadcast = node.get("broadcast") or {}
+            username = (broadcast.get("profile") or {}).get("username")
+            token_id = broadcast.get("buyTokenId")
+            if not broadcast.get("id") or not username or not token_id:
+                continue
+            broadcasts.append(broadcast)
+            profile = node.get("profile") or {}
+            profile.update({"id": broadcast["profile"].get("id"), "username": username})
+            profiles[username] = profile
+            token = node.get("token") or {}
+            token["id"] = token_id
+            tokens[token_id] = token
+    return {"broadcasts": broadcasts, "profiles": profiles, "tokens": tokens}
+
+
+class StandIn:
+    def __init__(self, fixtures, rate=2.0, latency_ms=30.0, jitter_ms=10.0, volatility=0.02, seed=None,
+                 max_in_flight=0, error_rate=0.0, retry_after=1):
+        self.fixtures = fixtures
+        self.max_in_flight = max_in_flight
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.throttled = 0
+        self.failed = 0
+        self.rate = rate
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.feed = []
+        self.emitted = []
+        self.prices = {token_id: token.get("price") or 1e-6 for token_id, token in fixtures["tokens"].items()}
+        self.requests = 0
+        self.by_operation = {}
+        self.request_bytes = 0
+        self.persisted = {}
+        self.response_bytes = 0
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._emit_loop, daemon=True).start()
+        threading.Thread(target=self._price_loop, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _emit_loop(self):
+        while not self._stopped.is_set():
+            if self.rate <= 0:
+                self._stopped.wait(0.5)
+                continue
+            self._stopped.wait(self.random.expovariate(self.rate))
+            template = self.random.choice(self.fixtures["broadcasts"])
+            broadcast = copy.deepcopy(template)
+            broadcast["id"] = str(uuid.uuid4())
+            broadcast["createdAt"] = int(time.time() * 1000)
+            with self.lock:
+                broadcast["buyTokenPrice"] = self.prices.get(broadcast.get("buyTokenId"), broadcast.get("buyTokenPrice"))
+                self.feed.insert(0, broadcast)
+                del self.feed[5000:]
+                self.emitted.append((broadcast["id"], broadcast["createdAt"]))
+
+    def _price_loop(self):
+        while not self._stopped.wait(1.0):
+            with self.lock:
+                for token_id, price in self.prices.items():
+                    self.prices[token_id] = price * (1 + self.random.gauss(0, self.volatility))
+
+    def token(self, token_id):
+        token = self.fixtures["tokens"].get(token_id)
+        if token is None:
+            return None
+        token = dict(token)
+        with self.lock:
+            token["price"] = self.prices.get(token_id, token.get("price"))
+        return token
+
+    def profile(self, username):
+        return self.fixtures["profiles"].get(username)
+
+    def feed_page(self, args):
+        first = args.get("first") or 10
+        after = args.get("after")
+        with self.lock:
+            feed = list(self.feed)
+        start = 0
+        if after:
+            for i, broadcast in enumerate(feed):
+                if broadcast["id"] == after:
+                    start = i + 1
+                    break
+        page = feed[start:start + first]
+        edges = [{
+            "cursor": broadcast["id"],
+            "node": {
+                "broadcast": broadcast,
+                "buyToken": self.token(broadcast.get("buyTokenId")),
+                "sellToken": self.token(broadcast.get("sellTokenId")),
+            },
+        } for broadcast in page]
+        return {
+            "edges": edges,
+            "pageInfo": {"endCursor": page[-1]["id"] if page else after, "hasNextPage": start + first < len(feed)},
+        }
+
+    def resolve(self, alias, name, args):
+        if name == "feedV3":
+            return self.feed_page(args)
+        if name == "profile":
+            return self.profile(args.get("username"))
+        if name == "token":
+            return self.token(args.get("id"))
+        return None
+
+    def execute(self, body):
+        query = body.get("query") or ""
+        persisted = ((body.get("extensions") or {}).get("persistedQuery") or {}).get("sha256Hash")
+        if persisted:
+            # Automatic persisted queries: remember text sent with its hash, answer hash-only requests from memory.
+            if query:
+                if hashlib.sha256(query.encode("utf-8")).hexdigest() != persisted:
+                    return {"errors": [{"message": "provided sha does not match query"}]}
+                with self.lock:
+                    self.persisted[persisted] = query
+            else:
+                with self.lock:
+                    query = self.persisted.get(persisted)
+                if query is None:
+                    return {"errors": [{"message": "PersistedQueryNotFound",
+                                        "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]}
+        data = {}
+        for alias, name, args, selections in parse_document(query, body.get("variables")):
+            data[alias] = project(self.resolve(alias, name, args), selections)
+        return {"data": data}
+
+    def admit(self):
+        """None to serve the request (call ``finish`` afterwards), else the (status, headers) to refuse it with."""
+        with self.lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.throttled += 1
+                return 429, {"Retry-After": str(self.retry_after)}
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.failed += 1
+                return 503, {}
+            self.in_flight += 1
+            return None
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record(self, operation, request_bytes, response_bytes):
+        with self.lock:
+            self.requests += 1
+            self.by_operation[operation] = self.by_operation.get(operation, 0) + 1
+            self.request_bytes += request_bytes
+            self.response_bytes += response_bytes
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "by_operation": dict(self.by_operation),
+                "request_bytes": self.request_bytes,
+                "response_bytes": self.response_bytes,
+                "throttled": self.throttled,
+                "failed": self.failed,
+                "emitted": list(self.emitted),
+            }
+
+    def delay(self):
+        delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+
+def _operation_name(body):
+    if body.get("operationName"):
+        return body["operationName"]
+    match = re.search(r"query\s+([A-Za-z_][A-Za-z0-9_]*)", body.get("query") or "")
+    return match.group(1) if match else "anonymous"
+
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            out = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            try:
+                self.wfile.write(out)
+            except (BrokenPipeError, ConnectionResetError):
+                # The scraper went away mid-response (e.g. SIGINT at the end of a benchmark).
+                pass
+            return len(out)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send(200, standin.stats())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            refused = standin.admit()
+            if refused is not None:
+                status, headers = refused
+                self._send(status, {"errors": [{"message": f"HTTP {status}"}]}, headers)
+                return
+            try:
+                standin.delay()
+                body = json.loads(raw or b"{}")
+                payload = standin.execute(body)
+                status = 200
+            except (ValueError, QueryParseError) as e:
+                body = {}
+                payload = {"errors": [{"message": str(e)}]}
+                status = 400
+            finally:
+                standin.finish()
+            sent = self._send(status, payload)
+            standin.record(_operation_name(body), len(raw), sent)
+
+    return Handler
+
+
+def serve(standin, host="127.0.0.1", port=8765):
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    server.daemon_threads = True
+    standin.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=2.0, help="new broadcasts per second")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--fixtures", help="fixture JSON; defaults to one rebuilt from --csv")
+    parser.add_argument("--csv", default="enriched_broadcasts.csv")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-in-flight", type=int, default=0, help="429 beyond this many concurrent requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with a 503")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures, "r", encoding="utf-8") as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = fixtures_from_csv(args.csv)
+    standin = StandIn(fixtures, rate=args.rate, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed,
+                      max_in_flight=args.max_in_flight, error_rate=args.error_rate)
+    server = serve(standin, args.host, args.port)
+    print(f"Stand-in GraphQL server on http://{args.host}:{args.port}/graphql "
+          f"({len(fixtures['broadcasts'])} broadcasts, {len(fixtures['tokens'])} tokens, {len(fixtures['profiles'])} profiles)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()